@@ -1,7 +1,262 @@
-from bcbackend import get_tvs, get_ip_and_psk
-from bcfrontend import FrontendGUI
+import json
+import sys
+from argparse import ArgumentParser
+from ipaddress import ip_address, ip_network
+from pathlib import Path
 
-ip_and_psk_list = get_ip_and_psk()
-tvs = get_tvs(ip_and_psk_list)
-interface = FrontendGUI(tvs)
-interface.launch()
\ No newline at end of file
+# Only the standard library is imported up front. Each command imports what it uses, so a scripted command
+# never pays for Gradio, aiohttp or discovery.
+base_path = Path(__file__).resolve().parent
+fleet_commands = {
+    'power': 'on, off or toggle',
+    'input': 'input title, label or URI',
+    'volume': 'volume level',
+    'mute': 'true or false',
+    'launch': 'app title or URI',
+    'terminate': None
+}
+api_commands = list(fleet_commands) + ['status', 'keys', 'macro']
+credential_actions = ['import', 'set', 'remove', 'list']
+api_port = 8000
+api_fields = {
+    'value': (str, int, float, bool),
+    'ip': (list,),
+    'group': (str,),
+    'all': (bool,),
+    'psk': (str,),
+    'keys': (list,),
+    'delay': (int, float),
+    'dry_run': (bool,)
+}
+
+def add_target_arguments(parser):
+    targets = parser.add_mutually_exclusive_group(required=True)
+    targets.add_argument('--ip', nargs='+', type=ip_address, help='TVs to control, skipping discovery')
+    targets.add_argument('--group', help='TV group defined in the macros file')
+    targets.add_argument('--all', action='store_true', help='every TV found by discovery')
+    parser.add_argument('--psk', default=None, help='pre-shared key, instead of the stored one')
+
+def get_parser():
+    parser = ArgumentParser(prog='bc', description='Bravia Control')
+    parser.add_argument('--rest-port', type=int, default=None, metavar='PORT', help='REST API port of the TVs')
+    parser.add_argument('--macros', type=Path, default=None, metavar='PATH',
+                        help='JSON or YAML file of macros, TV groups and schedules')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--scan', nargs='+', default=[], metavar='CIDR', type=lambda n: ip_network(n, strict=False),
+                        help='subnets to sweep for TVs when SSDP cannot reach them')
+    parser.add_argument('--scan-rate', type=float, default=None, help='maximum connection attempts per second')
+    parser.add_argument('--poll-interval', type=float, default=None,
+                        help='seconds between status polls of each active TV')
+    parser.add_argument('--metrics-port', type=int, default=None, metavar='PORT',
+                        help='serve Prometheus metrics on /metrics and p50/p99 latencies on /latency')
+    parser.add_argument('--trace-log', default=None, metavar='PATH',
+                        help='append a JSON line per API call and callback')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.add_parser('gui', help='start the web interface (the default)')
+    for action, value in fleet_commands.items():
+        command = commands.add_parser(action, help=f'run {action} on TVs')
+        if value: command.add_argument('value', help=value)
+        add_target_arguments(command)
+    command = commands.add_parser('status', help='print power, input and volume of TVs')
+    add_target_arguments(command)
+    command = commands.add_parser('keys', help='send remote-control keys')
+    command.add_argument('keys', nargs='+', help='IRCC key names, e.g. Home Down Confirm')
+    command.add_argument('--delay', type=float, default=None, help='seconds between keys')
+    add_target_arguments(command)
+    command = commands.add_parser('macro', help='run a macro from the macros file')
+    command.add_argument('value', metavar='name')
+    command.add_argument('--dry-run', action='store_true', help='run against simulated TVs')
+    add_target_arguments(command)
+    command = commands.add_parser('credentials', help='manage the encrypted pre-shared key store')
+    command.add_argument('action', choices=credential_actions)
+    command.add_argument('value', nargs='?', help='file to import, or the key to set')
+    command.add_argument('--ip', type=ip_address)
+    command.add_argument('--mac')
+    command.add_argument('--serial')
+    command = commands.add_parser('api', help='serve the commands as a JSON HTTP API, without the interface')
+    command.add_argument('--host', default='127.0.0.1')
+    command.add_argument('--port', type=int, default=api_port)
+    return parser
+
+def get_macros_path(args):
+    from bcmacros import macros_filename
+    return args.macros or base_path/macros_filename
+
+def get_targets(args, ips=None, group=None, all=False, psk=None):
+    from bcbackend import get_ip_and_psk
+    if all:
+        from contextlib import redirect_stdout
+        from bcdiscovery import TVDirectory
+        # Discovery prints its progress and the TVs it found; stdout is kept for the results.
+        with redirect_stdout(sys.stderr):
+            directory = TVDirectory(get_ip_and_psk())
+            directory.discover()
+        tvs = [tv for tv in directory.tvs if tv.get('online')]
+    else:
+        if group is not None:
+            from bcmacros import load_macros
+            groups = load_macros(get_macros_path(args))['groups']
+            if group not in groups: raise ValueError(f'Unknown group: {group}')
+            ips = groups[group]
+        from bccredentials import credentials
+        psks = {tv['ip']: tv['psk'] for tv in get_ip_and_psk()}
+        tvs = [{'ip': ip_address(ip), 'psk': psks.get(ip_address(ip)) or credentials.resolve({'ip': ip})}
+               for ip in ips or []]
+    if psk is not None: tvs = [{**tv, 'psk': psk} for tv in tvs]
+    return tvs
+
+def run_command(args, command, value=None, ips=None, group=None, all=False, psk=None, keys=None, delay=None,
+                dry_run=False):
+    tvs = get_targets(args, ips=ips, group=group, all=all, psk=psk)
+    if command == 'macro':
+        from bcmacros import MacroEngine
+        engine = MacroEngine(tvs, path=get_macros_path(args))
+        run = engine.run(value, group=group, ips=[tv['ip'] for tv in tvs], dry_run=dry_run)
+        return run['results'], ['ip', 'model', 'ok', 'latency']
+    if command == 'status':
+        from bcfleet import run_status, status_headers
+        return run_status(tvs), status_headers
+    if command == 'keys':
+        from bcbackend import get_client
+        from bcircc import IRCCClient, key_delay
+        results = []
+        for tv in tvs:
+            ircc = IRCCClient(get_client(tv['ip']).with_psk(tv['psk']), tv)
+            try:
+                ircc.send_keys(keys, delay=key_delay if delay is None else delay)
+                results.append({'ip': str(tv['ip']), 'ok': True, 'error': None})
+            except Exception as e:
+                results.append({'ip': str(tv['ip']), 'ok': False, 'error': str(e) or type(e).__name__})
+        return results, ['ip', 'ok', 'error']
+    from bcfleet import run_fleet, result_headers
+    return run_fleet(tvs, command, value), result_headers
+
+def manage_credentials(args):
+    from bccredentials import credentials, read_credentials_file
+    ids = {'ip': args.ip, 'mac': args.mac, 'serial': args.serial}
+    if args.action == 'import':
+        # Many TVs at once, with a single encrypted write.
+        if args.value is None: raise ValueError('import needs a file')
+        items = list(read_credentials_file(args.value))
+        changed = credentials.update(items)
+        print(f'Imported {len(items)} keys, {changed} new or changed.')
+    elif args.action == 'set':
+        if args.value is None: raise ValueError('set needs a key')
+        credentials.set(args.value, **ids)
+    elif args.action == 'remove':
+        if not credentials.remove(**ids): raise ValueError('No stored key matches')
+    else:
+        credentials.load()
+        entries = [{**entry, 'psk': '****'} for entry in credentials.entries]
+        print_results(entries, ['ip', 'mac', 'serial', 'psk'], args.json)
+    return 0
+
+def print_results(results, headers, as_json=False):
+    if as_json:
+        print(json.dumps(results, indent=1, default=str))
+        return
+    rows = [headers] + [[str(result.get(key)) for key in headers] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(headers))]
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+def parse_api_body(command, data):
+    body = json.loads(data or '{}')
+    if not isinstance(body, dict): raise ValueError('Body must be a JSON object')
+    for key, value in body.items():
+        if key not in api_fields: raise ValueError(f'Unknown field: {key}')
+        if value is not None and not isinstance(value, api_fields[key]):
+            raise ValueError(f'Invalid {key}: {value!r}')
+    for key in ('ip', 'keys'):
+        if not all(isinstance(item, str) for item in body.get(key) or []):
+            raise ValueError(f'{key} must be a list of strings')
+    if command == 'keys' and not body.get('keys'): raise ValueError('keys needs a list of keys')
+    if sum(bool(body.get(key)) for key in ('ip', 'group', 'all')) != 1:
+        raise ValueError('Give exactly one of ip, group or all')
+    return body
+
+def serve_api(args):
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, status, data):
+            body = json.dumps(data, default=str).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            # POST /<command> with the command line options as JSON, e.g. {"value": "off", "group": "lobby"}.
+            command = self.path.strip('/')
+            if command not in api_commands:
+                return self.reply(404, {'error': f'Unknown command: {command}'})
+            try:
+                body = parse_api_body(command, self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+                results, _ = run_command(args, command, value=body.get('value'), ips=body.get('ip'),
+                                         group=body.get('group'), all=body.get('all', False), psk=body.get('psk'),
+                                         keys=body.get('keys'), delay=body.get('delay'),
+                                         dry_run=body.get('dry_run', False))
+            except (ValueError, AssertionError, KeyError) as e:
+                return self.reply(400, {'error': str(e)})
+            except Exception as e:
+                return self.reply(500, {'error': str(e) or type(e).__name__})
+            self.reply(200, {'ok': all(result.get('ok', True) for result in results), 'results': results})
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f'Serving the API on http://{args.host}:{args.port}/')
+    server.serve_forever()
+
+def launch_gui(args):
+    from bcbackend import get_ip_and_psk, get_networks_and_psk
+    from bcdiscovery import TVDirectory, scan_rate
+    from bcpoller import StatusPoller, poll_interval
+    from bcmetrics import serve_metrics, set_trace_log
+    from bcmacros import MacroEngine
+    from bcfrontend import FrontendGUI
+
+    if args.metrics_port: serve_metrics(args.metrics_port)
+    if args.trace_log: set_trace_log(args.trace_log)
+
+    ip_and_psk_list = get_ip_and_psk()
+    network_list = get_networks_and_psk() + [{'network': network, 'psk': None} for network in args.scan]
+    directory = TVDirectory(ip_and_psk_list, network_list)
+    directory.discover_in_background()
+    if network_list: directory.scan_in_background(rate=args.scan_rate or scan_rate)
+    poller = StatusPoller(directory.tvs, interval=args.poll_interval or poll_interval)
+    poller.start()
+    macros = None
+    if get_macros_path(args).is_file():
+        macros = MacroEngine(directory.tvs, path=get_macros_path(args))
+        macros.start()
+    interface = FrontendGUI(directory.tvs, poller=poller, macros=macros)
+    interface.launch()
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.rest_port:
+        import bcbackend
+        bcbackend.rest_port = args.rest_port
+    if args.command in (None, 'gui'):
+        return launch_gui(args)
+    if args.command == 'api':
+        return serve_api(args)
+    if args.command == 'credentials':
+        try:
+            return manage_credentials(args)
+        except (ValueError, OSError) as e:
+            print(f'Error: {e}', file=sys.stderr)
+            return 2
+    try:
+        results, headers = run_command(args, args.command, value=getattr(args, 'value', None), ips=args.ip,
+                                       group=args.group, all=args.all, psk=args.psk, keys=getattr(args, 'keys', None),
+                                       delay=getattr(args, 'delay', None), dry_run=getattr(args, 'dry_run', False))
+    except (ValueError, AssertionError, OSError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 2
+    print_results(results, headers, args.json)
+    return 0 if all(result.get('ok', result.get('online', True)) for result in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import asyncio
+import copy
+import json
+import aiohttp
+from ipaddress import ip_address
+from bcbackend import RESTRequest, RESTResponse, prepare_batch, failed_response, match_batch
+from bcbackend import tv_capabilities, negotiate, unsupported_response, get_base_url, get_breaker, get_result, is_json
+from bcbackend import connect_timeout, read_timeout, probe_timeout, max_retries, retry_backoff, pool_size
+from bcbackend import confirm_deadline, confirm_interval, confirm_max_interval
+from bcbackend import get_power
+from bcmetrics import timed_request
+
+async_probe_timeout = aiohttp.ClientTimeout(sock_connect=probe_timeout[0], sock_read=probe_timeout[1])
+
+class AsyncRESTClient:
+    def __init__(self, ip, psk=None, timeout=None, retries=max_retries, port=None):
+        self.ip = ip_address(ip)
+        self.psk = str(psk)
+        self.base_url = get_base_url(self.ip, port)
+        self.headers = {}
+        self.timeout = timeout or aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.retries = retries
+        # Held in a dict so with_psk copies share one session, and closing any of them closes it.
+        self._pool = {'session': None, 'loop': None}
+
+    @property
+    def session(self):
+        # A session is bound to the loop it was created on, so rebuild it if the caller's loop changed.
+        pool = self._pool
+        loop = asyncio.get_running_loop()
+        if pool['session'] is None or pool['session'].closed or pool['loop'] is not loop:
+            connector = aiohttp.TCPConnector(limit=pool_size)
+            pool['session'] = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            pool['loop'] = loop
+        return pool['session']
+
+    async def send_request(self, api_request, timeout=None):
+        supported, ver = negotiate(self.ip, api_request)
+        if not supported:
+            return unsupported_response(api_request)
+        url = self.base_url + api_request.service
+        self.headers['X-Auth-PSK'] = self.psk
+        headers = api_request.headers if api_request.headers else self.headers
+        params = api_request.params if isinstance(api_request.params, list) else [api_request.params]
+        payload = {
+            'method': api_request.method,
+            'params': params,
+            'id': api_request.id,
+            'version': ver
+        }
+        timeout = timeout or self.timeout
+        breaker = get_breaker(self.ip)
+        breaker.check()
+        with timed_request(self.ip, api_request) as call:
+            # Only failed connects are retried, as in RESTClient: a request that reached the TV is never resent.
+            for attempt in range(self.retries + 1):
+                try:
+                    async with self.session.post(url, headers=headers, json=payload, timeout=timeout) as response:
+                        body = await response.read()
+                        breaker.record_success()
+                        call['status'] = response.status
+                        call['bytes'] = len(body)
+                        if is_json(response.headers.get('Content-Type')):
+                            data = json.loads(body)
+                        else:
+                            data = body.decode(response.charset or 'utf-8', errors='replace')
+                        return RESTResponse(status_code=response.status, headers=response.headers, data=data)
+                except aiohttp.ClientConnectorError as e:
+                    if attempt < self.retries:
+                        await asyncio.sleep(retry_backoff * 2 ** attempt)
+                        continue
+                    breaker.record_failure(e)
+                    raise
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    breaker.record_failure(e)
+                    raise
+                except BaseException:
+                    breaker.abandon()
+                    raise
+
+    def with_psk(self, psk):
+        # Shares the pooled connection but keeps its own credentials, for callers that must not
+        # change the PSK other users of this TV are sending.
+        client = copy.copy(self)
+        client.psk = str(psk)
+        client.headers = {}
+        return client
+
+    async def send_batch(self, api_requests, id=1):
+        batch = prepare_batch(api_requests, id=id)
+        semaphore = asyncio.Semaphore(pool_size)
+
+        async def proc_request(api_request):
+            async with semaphore:
+                try:
+                    return await self.send_request(api_request)
+                except Exception as e:
+                    return failed_response(api_request, e)
+
+        responses = await asyncio.gather(*[proc_request(api_request) for api_request in batch])
+        return match_batch(batch, responses)
+
+    async def close(self):
+        if self._pool['session'] is not None:
+            await self._pool['session'].close()
+
+class NotificationWatcher:
+    def __init__(self, client, service, name, parse=None, version='1.0'):
+        self.client = client
+        self.service = service
+        self.name = name
+        self.parse = parse or (lambda params: params)
+        self.version = version
+        self.ws = None
+
+    async def __aenter__(self):
+        capabilities = tv_capabilities.get(self.client.ip)
+        if capabilities and self.service in capabilities and self.name not in capabilities[self.service]:
+            return self
+        url = self.client.base_url.replace('http://', 'ws://', 1) + self.service
+        request = {
+            'method': 'switchNotifications',
+            'params': [{'enabled': [{'name': self.name, 'version': self.version}], 'disabled': []}],
+            'id': 1,
+            'version': '1.0'
+        }
+        try:
+            self.ws = await self.client.session.ws_connect(url, headers={'X-Auth-PSK': self.client.psk})
+            await self.ws.send_json(request)
+            response = await asyncio.wait_for(self.ws.receive_json(), connect_timeout)
+            enabled = [item['name'] for item in (response.get('result') or [{}])[0].get('enabled', [])]
+            if self.name not in enabled: raise ValueError(f'{self.name} not supported')
+        except:
+            await self.close()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+            self.ws = None
+
+    async def wait(self, predicate, timeout):
+        if self.ws is None: return None
+
+        async def receive():
+            while True:
+                message = await self.ws.receive_json()
+                if message.get('method') != self.name or not message.get('params'): continue
+                value = self.parse(message['params'][0])
+                if predicate(value): return value
+
+        try:
+            return await asyncio.wait_for(receive(), timeout)
+        except:
+            return None
+
+async def async_confirm(getter, predicate, watcher=None, deadline=confirm_deadline, interval=confirm_interval,
+                        max_interval=confirm_max_interval):
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+
+    async def check():
+        try: value = await getter()
+        except: value = None
+        return value is not None and predicate(value), value
+
+    confirmed, value = await check()
+    if confirmed: return True, value
+    if watcher is not None and watcher.ws is not None:
+        # The TV pushes the change itself; poll once more only if the push never arrives.
+        pushed = await watcher.wait(predicate, end - loop.time())
+        if pushed is not None: return True, pushed
+        return await check()
+    while True:
+        remaining = end - loop.time()
+        if remaining <= 0: return False, value
+        await asyncio.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+        confirmed, value = await check()
+        if confirmed: return True, value
+
+async_clients = {}
+
+def get_async_client(ip, psk=None):
+    ip = ip_address(ip)
+    client = async_clients.get(ip)
+    if client is None:
+        client = async_clients[ip] = AsyncRESTClient(ip, psk=psk)
+    elif psk is not None:
+        client.psk = str(psk)
+    return client
+
+async def async_get_power_status(client):
+    get_request = RESTRequest('system', 'getPowerStatus')
+    return get_power(get_result(await client.send_request(get_request))[0]).active
+
+async def async_get_playing_uri(client):
+    request = RESTRequest('avContent', 'getPlayingContentInfo')
+    response = await client.send_request(request)
+    result = response.data.get('result') if isinstance(response.data, dict) else None
+    return result[0].get('uri') if result else None
@@ -1,22 +1,59 @@
+import copy
+import hashlib
+import json
 import requests
-from ipaddress import ip_address
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ipaddress import ip_address, ip_network
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from fnmatch import fnmatch
-from tqdm import tqdm
-import html
-import zlib
-import urllib.request
 from urllib.parse import urlparse
 import os
+import socket
+import threading
+import time
 from pathlib import Path
-from ssdpy import SSDPClient
+from bccredentials import credentials
+from bcicons import icon_cache
+from bcmetrics import timed_request
+from bcmodels import PowerState, InputInfo, AppInfo, VolumeInfo, index_by_uri
 
 base_path = Path(os.path.realpath(__file__)).parent
-cache_path = base_path/'iconcache'
 input_filename = 'tvs.txt'
+rest_port = 80
+ssdp_port = 1900
+ssdp_timeout = 2
+ssdp_address = None
+capabilities_filename = 'capabilities.json'
+discovery_filename = 'tvs.json'
+connect_timeout = 3.05
+read_timeout = 10.0
+max_retries = 2
+retry_backoff = 0.25
+pool_size = 8
+probe_timeout = (1.0, 2.0)
+failure_threshold = 3
+open_interval = 5.0
+max_open_interval = 120.0
+trial_timeout = 15.0
+wol_port = 9
+wol_address = None
+wake_deadline = 30.0
+confirm_deadline = 15.0
+confirm_interval = 0.1
+confirm_max_interval = 1.0
+state_methods = [
+    ('system', 'getNetworkSettings'),
+    ('system', 'getPowerStatus'),
+    ('avContent', 'getCurrentExternalInputsStatus'),
+    ('avContent', 'getPlayingContentInfo'),
+    ('audio', 'getVolumeInformation'),
+    ('appControl', 'getApplicationList')
+]
+authenticated_state_methods = [method for method in state_methods if method[1] != 'getNetworkSettings']
 
 class RESTRequest:
-    def __init__(self, service, method, headers=None, params=None, id=1, ver=1.0):
+    def __init__(self, service, method, headers=None, params=None, id=1, ver=None):
         self.service = service
         self.method = method
         self.headers = headers or {}
@@ -30,99 +67,523 @@ class RESTResponse:
         self.headers = headers or {}
         self.data = data
 
+tv_capabilities = {}
+capabilities_lock = threading.Lock()
+
+def version_key(version):
+    return tuple(int(part) for part in str(version).split('.') if part.isdigit())
+
+def negotiate(ip, api_request):
+    # Unknown TVs and unlisted services are let through at the requested or base version.
+    capabilities = tv_capabilities.get(ip)
+    if not capabilities or api_request.service not in capabilities:
+        return True, str(api_request.ver or '1.0')
+    versions = capabilities[api_request.service].get(api_request.method)
+    if not versions:
+        return False, None
+    if api_request.ver is not None:
+        return str(api_request.ver) in versions, str(api_request.ver)
+    return True, max(versions, key=version_key)
+
+def unsupported_response(api_request):
+    return RESTResponse(status_code=501, data={'error': [12, f'{api_request.method} is not supported'],
+                                               'id': api_request.id})
+
+def read_capabilities():
+    try:
+        with open(base_path/capabilities_filename) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def write_capabilities(cached):
+    capabilities_path = base_path/capabilities_filename
+    temp_path = capabilities_path.with_suffix('.tmp')
+    with open(temp_path, 'w') as file:
+        json.dump(cached, file, indent=1)
+    os.replace(temp_path, capabilities_path)
+
+def get_capabilities(client, tv=None):
+    if client.ip in tv_capabilities:
+        return tv_capabilities[client.ip]
+    if tv is None or 'modelName' not in tv:
+        request = RESTRequest('system', 'getInterfaceInformation')
+        tv = get_result(client.send_request(request, timeout=probe_timeout))[0]
+    key = f'{tv["modelName"]}/{tv.get("interfaceVersion")}'
+    with capabilities_lock:
+        cached = read_capabilities()
+        if key in cached:
+            tv_capabilities[client.ip] = cached[key]
+            return cached[key]
+    request = RESTRequest('guide', 'getSupportedApiInfo', params={'services': []})
+    try:
+        # The full API list is slow to build on some models, so only the connect is held to the probe timeout.
+        result = get_result(client.send_request(request, timeout=(probe_timeout[0], read_timeout)))[0]
+        capabilities = {}
+        for service in result:
+            entries = service.get('apis', []) + service.get('notifications', [])
+            capabilities[service['service']] = {entry['name']: [version['version'] for version in entry['versions']]
+                                                for entry in entries}
+    except RuntimeError:
+        # Models without the guide API are remembered too, so they are not asked again.
+        capabilities = None
+    except Exception:
+        # Only an optimisation: a lookup that times out or fails to connect leaves the TV unknown, so negotiate
+        # lets requests through, and it is tried again next time.
+        return None
+    with capabilities_lock:
+        cached = read_capabilities()
+        cached[key] = capabilities
+        write_capabilities(cached)
+        tv_capabilities[client.ip] = capabilities
+    return capabilities
+
+def prepare_batch(api_requests, id=1):
+    batch = []
+    for i, api_request in enumerate(api_requests):
+        api_request = copy.copy(api_request)
+        api_request.id = id + i
+        batch.append(api_request)
+    return batch
+
+def failed_response(api_request, error):
+    return RESTResponse(status_code=None, data={'error': [None, str(error) or type(error).__name__],
+                                                'id': api_request.id})
+
+def match_batch(batch, responses):
+    matched = {}
+    for api_request, response in zip(batch, responses):
+        data_id = response.data.get('id') if isinstance(response.data, dict) else None
+        matched[data_id if data_id is not None else api_request.id] = response
+    return [matched.get(api_request.id) or failed_response(api_request, 'No response with matching id')
+            for api_request in batch]
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+class CircuitBreaker:
+    # Closed passes requests, open fails them at once, and half-open lets a single trial through. A TV that
+    # stops answering costs a few timeouts, then nothing, until a probe or trial finds it back.
+    def __init__(self, ip, threshold=failure_threshold, interval=open_interval, max_interval=max_open_interval,
+                 trial_timeout=trial_timeout):
+        self.ip = ip
+        self.threshold = threshold
+        self.interval = interval
+        self.max_interval = max_interval
+        self.trial_timeout = trial_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened = 0
+        self.retry_at = 0.0
+        self.trial_until = 0.0
+        self.last_error = None
+        self.last_success = None
+        self.lock = threading.Lock()
+
+    @property
+    def online(self):
+        return self.state != 'open'
+
+    def check(self):
+        with self.lock:
+            if self.state == 'closed': return
+            now = time.monotonic()
+            # A trial that never reports back lets another through once its deadline passes.
+            if now >= (self.retry_at if self.state == 'open' else self.trial_until):
+                self.state = 'half-open'
+                self.trial_until = now + self.trial_timeout
+                return
+        raise CircuitOpenError(f'{self.ip} is offline')
+
+    def abandon(self):
+        # The trial was cancelled or failed for a reason that says nothing about the TV, so the next request
+        # may try again straight away.
+        with self.lock:
+            if self.state != 'half-open': return
+            self.state = 'open'
+            self.retry_at = time.monotonic()
+
+    def reset(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.opened = 0
+            self.last_success = time.time()
+
+    def record_failure(self, error):
+        with self.lock:
+            self.failures += 1
+            self.last_error = str(error) or type(error).__name__
+            if self.state == 'half-open' or self.failures >= self.threshold:
+                self.opened += 1
+                self.state = 'open'
+                self.retry_at = time.monotonic() + min(self.interval * 2 ** (self.opened - 1), self.max_interval)
+        if self.state == 'open' and self.last_success is not None: start_health_monitor()
+
+    def get_health(self):
+        with self.lock:
+            return {'ip': str(self.ip), 'state': self.state, 'failures': self.failures,
+                    'last_error': self.last_error, 'last_success': self.last_success}
+
+breakers = {}
+breakers_lock = threading.Lock()
+health_thread = None
+
+def get_breaker(ip):
+    ip = ip_address(ip)
+    with breakers_lock:
+        breaker = breakers.get(ip)
+        if breaker is None: breaker = breakers[ip] = CircuitBreaker(ip)
+    return breaker
+
+def is_online(ip):
+    breaker = breakers.get(ip_address(ip))
+    return breaker is None or breaker.online
+
+def probe_tv(ip):
+    # Goes around the breaker on purpose: a plain getPowerStatus with short timeouts.
+    client = get_client(ip)
+    payload = {'method': 'getPowerStatus', 'params': [{}], 'id': 1, 'version': '1.0'}
+    breaker = get_breaker(ip)
+    try:
+        client.session.post(client.base_url + 'system', json=payload, timeout=probe_timeout)
+    except requests.RequestException as e:
+        with breaker.lock:
+            breaker.last_error = str(e) or type(e).__name__
+        return False
+    breaker.record_success()
+    return True
+
+def run_health_monitor():
+    # Only TVs that have answered before are probed, so addresses that never were TVs do not
+    # keep a thread busy. Those are left to half-open trials.
+    global health_thread
+    while True:
+        with breakers_lock:
+            probes = [breaker.ip for breaker in breakers.values()
+                      if breaker.state == 'open' and breaker.last_success is not None]
+        if not probes: break
+        with ThreadPoolExecutor(max_workers=min(16, len(probes))) as pool:
+            list(pool.map(probe_tv, probes))
+        time.sleep(open_interval)
+    with breakers_lock:
+        health_thread = None
+
+def start_health_monitor():
+    global health_thread
+    with breakers_lock:
+        if health_thread is not None: return
+        health_thread = threading.Thread(target=run_health_monitor, daemon=True)
+        health_thread.start()
+
+def is_json(content_type):
+    # TVs send 'application/json; charset=UTF-8' as often as plain 'application/json'.
+    return (content_type or '').partition(';')[0].strip().lower() == 'application/json'
+
+def get_rest_port():
+    return rest_port
+
+def get_base_url(ip, port=None):
+    host = f'[{ip}]' if ip.version == 6 else str(ip)
+    port = port or get_rest_port()
+    return f'http://{host}/sony/' if port == 80 else f'http://{host}:{port}/sony/'
+
 class RESTClient:
-    def __init__(self, ip, psk=None):
+    def __init__(self, ip, psk=None, timeout=None, retries=max_retries, port=None):
         self.ip = ip_address(ip)
         self.psk = str(psk)
-        self.base_url = f'http://{self.ip}/sony/'
+        self.base_url = get_base_url(self.ip, port)
         self.headers = {}
+        self.timeout = timeout or (connect_timeout, read_timeout)
+        # Retry only failed connects, never a request the TV may have already received and acted on. Even a 5xx
+        # reply can follow a setPowerStatus, a relative volume step or a key press that took effect.
+        retry = Retry(total=retries, connect=retries, read=0, status=0, other=0, backoff_factor=retry_backoff,
+                      allowed_methods=None, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
 
-    def send_request(self, api_request):
+    def send_request(self, api_request, timeout=None):
+        supported, ver = negotiate(self.ip, api_request)
+        if not supported:
+            return unsupported_response(api_request)
         url = self.base_url + api_request.service
         self.headers['X-Auth-PSK'] = self.psk
         headers = api_request.headers if api_request.headers else self.headers
         params = api_request.params if isinstance(api_request.params, list) else [api_request.params]
-        response = requests.post(
-            url,
-            headers=headers,
-            json={
-                'method': api_request.method,
-                'params': params,
-                'id': api_request.id,
-                'version': str(api_request.ver)
-            }
-        )
+        breaker = get_breaker(self.ip)
+        breaker.check()
+        with timed_request(self.ip, api_request) as call:
+            try:
+                response = self.session.post(
+                    url,
+                    headers=headers,
+                    json={
+                        'method': api_request.method,
+                        'params': params,
+                        'id': api_request.id,
+                        'version': ver
+                    },
+                    timeout=timeout or self.timeout
+                )
+            except requests.RequestException as e:
+                breaker.record_failure(e)
+                raise
+            except BaseException:
+                breaker.abandon()
+                raise
+            breaker.record_success()
+            call['status'] = response.status_code
+            call['bytes'] = len(response.content)
 
         return RESTResponse(
             status_code=response.status_code,
             headers=response.headers,
-            data=response.json() if response.headers['Content-Type'] == 'application/json' else response.text
+            data=response.json() if is_json(response.headers.get('Content-Type')) else response.text
         )
+
+    def with_psk(self, psk):
+        # Shares the pooled connection but keeps its own credentials, for callers that must not
+        # change the PSK other users of this TV are sending.
+        client = copy.copy(self)
+        client.psk = str(psk)
+        client.headers = {}
+        return client
+
+    def send_batch(self, api_requests, id=1):
+        batch = prepare_batch(api_requests, id=id)
+        if not batch: return []
+
+        def proc_request(api_request):
+            try:
+                return self.send_request(api_request)
+            except Exception as e:
+                return failed_response(api_request, e)
+
+        # The TV has no batch endpoint, so every request is its own POST, sent concurrently over the pool.
+        with ThreadPoolExecutor(max_workers=min(pool_size, len(batch))) as pool:
+            futures = [pool.submit(proc_request, api_request) for api_request in batch]
+        return match_batch(batch, [future.result() for future in futures])
+
+    def get_wake_mac(self):
+        return get_wake_mac(self.ip)
+
+    def wake(self, mac):
+        if mac: send_magic_packet(mac, self.ip)
+        # Failures are expected while it wakes, so they must not trip the breaker into failing fast.
+        get_breaker(self.ip).reset()
+
+    def learn_wake_mac(self):
+        # Learnt while the TV is awake, so the next power-on can wake it from deep standby.
+        save_wake_mac(self.ip, get_tv_mac(self))
+
+    def close(self):
+        self.session.close()
+
+clients = {}
+clients_lock = threading.Lock()
+
+def get_client(ip, psk=None):
+    ip = ip_address(ip)
+    with clients_lock:
+        client = clients.get(ip)
+        if client is None:
+            client = clients[ip] = RESTClient(ip, psk=psk)
+        elif psk is not None:
+            client.psk = str(psk)
+    return client
     
-def get_ip_and_psk():
-    tv_list = []
+class TVState:
+    def __init__(self, responses=None):
+        self.responses = responses or {}
+        self.parsed = {}
+
+    @classmethod
+    def fetch(cls, client, id=1, methods=state_methods):
+        state = cls()
+        state.update(client, id=id, methods=methods)
+        return state
+
+    def update(self, client, id=1, methods=state_methods):
+        responses = client.send_batch([RESTRequest(service, method) for service, method in methods], id=id)
+        self.responses.update({method: response for (_, method), response in zip(methods, responses)})
+        self.parsed.clear()
+
+    @classmethod
+    async def afetch(cls, client, id=1, methods=state_methods):
+        state = cls()
+        await state.aupdate(client, id=id, methods=methods)
+        return state
+
+    async def aupdate(self, client, id=1, methods=state_methods):
+        responses = await client.send_batch([RESTRequest(service, method) for service, method in methods], id=id)
+        self.responses.update({method: response for (_, method), response in zip(methods, responses)})
+        self.parsed.clear()
+
+    def response(self, method):
+        response = self.responses.get(method)
+        if response is None or not isinstance(response.data, dict):
+            return None
+        return response
+
+    def result(self, method):
+        response = self.response(method)
+        if response is None or not response.data.get('result'):
+            return None
+        return response.data['result'][0]
+
+    def parse(self, key, parser):
+        # Parsed on first use and kept until the next update, so renders read the same objects.
+        if key not in self.parsed: self.parsed[key] = parser()
+        return self.parsed[key]
+
+    @property
+    def auth_status(self):
+        response = self.responses.get('getNetworkSettings')
+        return response is not None and response.status_code not in (None, 403)
+
+    @property
+    def forbidden(self):
+        return any(response.status_code == 403 for response in self.responses.values())
+
+    @property
+    def power(self):
+        return self.parse('power', lambda: get_power(self.result('getPowerStatus')))
+
+    @property
+    def power_status(self):
+        power = self.power
+        return power is not None and power.active
+
+    @property
+    def inputs(self):
+        response = self.response('getCurrentExternalInputsStatus')
+        return self.parse('inputs', lambda: get_inputs(response) if response else None)
+
+    @property
+    def inputs_by_uri(self):
+        return self.parse('inputs_by_uri', lambda: index_by_uri(self.inputs or []))
+
+    @property
+    def input(self):
+        input_response = self.response('getPlayingContentInfo')
+        if input_response is None or self.inputs is None:
+            return None
+        return get_input(input_response, self.inputs_by_uri)
+
+    @property
+    def volume(self):
+        response = self.response('getVolumeInformation')
+        return self.parse('volume', lambda: get_volumes(response) if response else None)
+
+def read_tvs_file():
     input_file = base_path/input_filename
-    if not input_file.is_file(): return tv_list
+    if not input_file.is_file(): return
     with open(input_file) as file:
         for line in file:
             if not line.strip(): continue
-            ip, *psk = line.split(',', 1)
-            try: ip = ip_address(ip)
-            except: continue
-            psk = psk[0] if psk else None
-            psk = psk.strip('\n')
-            tv_list.append({'ip': ip, 'psk': psk})
+            address, *psk = line.split(',', 1)
+            psk = psk[0].strip('\n') if psk else None
+            yield address.strip(), psk
+
+def get_ip_and_psk():
+    tv_list = []
+    for ip, psk in read_tvs_file():
+        try: ip = ip_address(ip)
+        except: continue
+        tv_list.append({'ip': ip, 'psk': psk if psk is not None else credentials.resolve({'ip': ip})})
     return tv_list
 
-def get_tvs(tv_list=[]):
+def get_networks_and_psk():
+    network_list = []
+    for network, psk in read_tvs_file():
+        if '/' not in network: continue
+        try: network = ip_network(network, strict=False)
+        except: continue
+        network_list.append({'network': network, 'psk': psk})
+    return network_list
+
+def ssdp_search():
+    # Imported on use, so scripted commands aimed at known TVs never load the discovery libraries.
+    from ssdpy import SSDPClient
+    ips = []
+    client = SSDPClient(port=ssdp_port, timeout=ssdp_timeout, address=ssdp_address)
+    results = client.m_search()
+    for r in results:
+        if '::' in r['usn'] and fnmatch(r['usn'].split('::')[-1], '*sony*'):
+            ips.append(ip_address(urlparse(r['location']).hostname))
+    return [{'ip': ip, 'psk': None} for ip in set(ips)]
+
+def get_tv_info(response, tv):
+    if not response or response.status_code != 200:
+        return None
+    result = response.data['result'][0]
+    result['ip'] = tv['ip']
+    result['psk'] = tv['psk']
+    name = result['productName']
+    category = result['productCategory'].lower()
+    if name and fnmatch(name, '*BRAVIA*') and category == 'tv':
+        return result
+    return None
+
+def print_tvs(tvs):
+    if not tvs:
+        print('\nNo TVs found. Need an SSDP response or IP(s) to proceed.\n')
+        return
+    print('\nFound TV(s):')
+    [print(r['ip'], ':', r['modelName']) for r in tvs]
+    print()
+
+def get_tvs(tv_list=None):
     print('\nDiscovering TVs. Please Wait...')
-    futures_list = []
     if not tv_list:
-        client = SSDPClient()
-        results = client.m_search()
-        for r in results:
-            if '::' in r['usn'] and fnmatch(r['usn'].split('::')[-1], '*sony*'):
-                ip = ip_address(urlparse(r['location']).hostname)
-                tv_list.append(ip)
-        tv_list = list(set(tv_list))
-        tv_list = [{'ip': ip, 'psk': None} for ip in tv_list]
+        tv_list = ssdp_search()
     
     def proc_request(tv):
-        client = RESTClient(tv['ip'])
+        client = get_client(tv['ip'], psk=tv['psk'])
         request = RESTRequest('system', 'getInterfaceInformation')
         try:
-            response = client.send_request(request)
-            response.ip = tv['ip']
-            response.psk = tv['psk']
+            response = client.send_request(request, timeout=probe_timeout)
+            result = get_tv_info(response, tv)
+            if result: get_capabilities(client, result)
         except:
-            response = None
-        return response
+            result = None
+        return result
 
+    from tqdm import tqdm
     with tqdm(total=len(tv_list), unit='ip', leave=False) as pbar:
         with ThreadPoolExecutor(max_workers=16) as pool:
             futures = [pool.submit(proc_request, tv) for tv in tv_list]
             for future in as_completed(futures):
-                futures_list.append(future)
                 pbar.update()
 
-    responses = []
-    for f in futures:
-        response = f.result()
-        if response and response.status_code == 200:
-            result = response.data['result'][0]
-            result['ip'] = response.ip
-            result['psk'] = response.psk
-            name = result['productName']
-            category = result['productCategory'].lower()
-            if name and fnmatch(name, '*BRAVIA*') and category == 'tv':
-                responses.append(result)
-
-    assert responses, 'No TVs found. Need an SSDP response or IP(s) to proceed.'
-    print('\nFound TV(s):')
-    [print(r['ip'], ':', r['modelName']) for r in responses]
-    print()
+    responses = [f.result() for f in futures if f.result()]
+    print_tvs(responses)
     return responses
 
+def get_tv_mac(client):
+    request = RESTRequest('system', 'getNetworkSettings')
+    try:
+        result = client.send_request(request, timeout=probe_timeout).data.get('result')
+    except:
+        return None
+    for item in result[0] if result else []:
+        if item.get('hwAddr'): return item['hwAddr'].lower()
+    return None
+
+def get_tv_serial(client):
+    request = RESTRequest('system', 'getSystemInformation')
+    try:
+        result = client.send_request(request, timeout=probe_timeout).data.get('result')
+    except:
+        return None
+    return result[0].get('serial') or None if result else None
+
 def get_auth_status(client):
     request = RESTRequest('system', 'getNetworkSettings')
     response = client.send_request(request)
@@ -130,53 +591,247 @@ def get_auth_status(client):
         return False
     return True
 
+def get_power(result):
+    return PowerState.parse(result) if result else None
+
 def get_power_status(client):
-        get_request = RESTRequest('system', 'getPowerStatus')
-        result = client.send_request(get_request)
-        status = result.data['result'][0]['status']
-        status = True if status == 'active' else False
-        return status
+    get_request = RESTRequest('system', 'getPowerStatus')
+    return get_power(get_result(client.send_request(get_request))[0]).active
+
+def confirm(getter, predicate, deadline=confirm_deadline, interval=confirm_interval,
+            max_interval=confirm_max_interval):
+    end = time.monotonic() + deadline
+    while True:
+        try: value = getter()
+        except: value = None
+        if value is not None and predicate(value): return True, value
+        remaining = end - time.monotonic()
+        if remaining <= 0: return False, value
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
 
 def get_inputs(response):
     if response.data.get('result'):
-        result = response.data['result'][0]
-        result = [{'index': i, **item} for i, item in enumerate(result)]
-        result = [{key: 'No Label' if key == 'label' and not value
-                   else value for key, value in item.items()} for item in result]
-        for item in result:
-            if item['uri'].startswith('extInput:cec?'):
-                item['title'] += ' (CEC)'
-        return result
+        return [InputInfo.parse(i, item) for i, item in enumerate(response.data['result'][0])]
     return None
 
-def get_input(input_response, inputs_response):
-    inputs = get_inputs(inputs_response)
+def get_input(input_response, inputs_by_uri):
     if input_response.data.get('result'):
-        input = input_response.data['result'][0]
-        for item in inputs:
-            if item['uri'] == input['uri']:
-                return item
+        return inputs_by_uri.get(input_response.data['result'][0].get('uri'))
     return None
 
-def get_apps(client):
-    request = RESTRequest('appControl', 'getApplicationList')
-    response = client.send_request(request)
+def get_volumes(response):
+    if response.data.get('result'):
+        return [VolumeInfo.parse(item) for item in response.data['result'][0]]
+    return None
+
+def get_app_list(response):
     if response.data.get('result') is None:
         return None
-    result = response.data['result'][0]
-    apps = result
-    for i, app in enumerate(apps):
-        app['index'] = i
-        app['title'] = html.unescape(app['title'])
-        icon_url = app['icon']
-        cached_icon_basename = str(hex(zlib.crc32(icon_url.encode('utf-8')) & 0xffffffff))
-        cached_icon_extension = icon_url.split(".")[-1]
-        cached_icon_filename = f'{cached_icon_basename}.{cached_icon_extension}'
+    return [AppInfo.parse(i, item) for i, item in enumerate(response.data['result'][0])]
+
+app_lists = {}
+app_lists_lock = threading.Lock()
+
+def get_cached_apps(ip, response):
+    # Keyed by a digest of the TV's list, so an install or removal on the TV invalidates it by itself.
+    # An unchanged list is not parsed again.
+    if not isinstance(response.data, dict) or response.data.get('result') is None:
+        return None, None, None
+    digest = hashlib.sha256(json.dumps(response.data['result'][0], sort_keys=True).encode()).hexdigest()
+    with app_lists_lock:
+        cached = app_lists.get(ip)
+        if cached is None or cached[0] != digest:
+            apps = sorted(get_app_list(response), key=lambda x: x.title)
+            cached = app_lists[ip] = (digest, apps, index_by_uri(apps))
+    return cached
+
+def invalidate_apps(ip):
+    with app_lists_lock:
+        app_lists.pop(ip, None)
+
+def get_apps(client, response=None):
+    if response is None:
+        request = RESTRequest('appControl', 'getApplicationList')
+        response = client.send_request(request)
+    apps = get_app_list(response)
+    if apps is None:
+        return None
+    icon_paths = icon_cache.get_many([app.icon for app in apps])
+    for app in apps:
+        app.cached_icon_path = icon_paths[app.icon]
+    apps = sorted(apps, key=lambda x: x.title)
+    return apps
+
+def get_result(response):
+    if not isinstance(response.data, dict) or 'result' not in response.data:
+        error = response.data.get('error') if isinstance(response.data, dict) else None
+        raise RuntimeError(f'HTTP {response.status_code}: {error or response.data}')
+    return response.data['result']
+
+def get_playing_uri(client):
+    request = RESTRequest('avContent', 'getPlayingContentInfo')
+    result = client.send_request(request).data.get('result')
+    return result[0].get('uri') if result else None
+
+def get_volume_status(client, target='speaker'):
+    request = RESTRequest('audio', 'getVolumeInformation')
+    for item in get_volumes(client.send_request(request)) or []:
+        if item.target == target:
+            return item
+    return None
+
+def find_input(client, name):
+    request = RESTRequest('avContent', 'getCurrentExternalInputsStatus')
+    inputs = get_inputs(client.send_request(request)) or []
+    name = name.strip()
+    item = index_by_uri(inputs).get(name)
+    if item: return item
+    name = name.lower()
+    for item in inputs:
+        if name in (item.uri.lower(), item.title.lower(), item.label.lower()):
+            return item
+    raise RuntimeError(f'Input not found: {name}')
+
+def find_app(client, name):
+    request = RESTRequest('appControl', 'getApplicationList')
+    _, apps, apps_by_uri = get_cached_apps(client.ip, client.send_request(request))
+    name = name.strip()
+    if name in (apps_by_uri or {}): return apps_by_uri[name]
+    name = name.lower()
+    for app in apps or []:
+        if name in (app.uri.lower(), app.title.lower()):
+            return app
+    raise RuntimeError(f'App not found: {name}')
+
+wake_macs = {}
+discovery_lock = threading.Lock()
+
+def read_discovery_cache():
+    try:
+        with open(base_path/discovery_filename) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return []
+
+def write_discovery_cache(cached):
+    discovery_path = base_path/discovery_filename
+    temp_path = discovery_path.with_suffix('.tmp')
+    with open(temp_path, 'w') as file:
+        json.dump(cached, file, indent=1)
+    os.replace(temp_path, discovery_path)
+
+def find_cached_tv(cached, ip):
+    for tv in cached:
         try:
-            cached_icon_path = str(cache_path/cached_icon_filename)
-            urllib.request.urlretrieve(icon_url, cached_icon_path)
-        except:
-            cached_icon_path = cache_path/'placeholder.png'
-        app['cached_icon_path'] = cached_icon_path
-    apps = sorted(apps, key=lambda x: x['title'])
-    return apps
\ No newline at end of file
+            if ip_address(tv['ip']) == ip: return tv
+        except (KeyError, ValueError):
+            continue
+    return None
+
+def set_wake_mac(ip, mac):
+    if mac: wake_macs[ip_address(ip)] = mac
+
+def get_wake_mac(ip):
+    ip = ip_address(ip)
+    if ip in wake_macs: return wake_macs[ip]
+    entry = credentials.find(ip=ip)
+    if entry and entry.get('mac'): return entry['mac']
+    # The commands never load the TV directory, so they fall back to the MACs discovery cached.
+    tv = find_cached_tv(read_discovery_cache(), ip)
+    if tv and tv.get('mac'): set_wake_mac(ip, tv['mac'])
+    return wake_macs.get(ip)
+
+def save_wake_mac(ip, mac):
+    set_wake_mac(ip, mac)
+    if not mac: return
+    entry = credentials.find(ip=ip)
+    if entry: credentials.set(entry['psk'], ip=ip, mac=mac)
+    with discovery_lock:
+        cached = read_discovery_cache()
+        tv = find_cached_tv(cached, ip_address(ip))
+        # Only TVs discovery has listed, as the directory needs their model to show them.
+        if tv is None or tv.get('mac') == mac: return
+        tv['mac'] = mac
+        write_discovery_cache(cached)
+
+def send_magic_packet(mac, ip=None, port=None):
+    payload = b'\xff' * 6 + bytes.fromhex(mac.replace(':', '').replace('-', '')) * 16
+    # Broadcast, plus straight to the TV's last address, which gets through while the switch still knows it.
+    targets = [wol_address or '255.255.255.255']
+    if ip is not None and ip_address(ip).version == 4:
+        targets += [str(ip_network(f'{ip}/24', strict=False).broadcast_address), str(ip)]
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        for target in targets:
+            try: sock.sendto(payload, (target, port or wol_port))
+            except OSError: pass
+
+def power_on(client, id=1, deadline=wake_deadline):
+    # A TV in deep standby has its network stack asleep. It is woken with a magic packet first, then asked to
+    # power on until it answers, and the packet is repeated each time it does not.
+    # Waking goes through the client, so a dry run's mock never sends a packet or touches the real TV's state.
+    mac = client.get_wake_mac()
+    request = RESTRequest('system', 'setPowerStatus', params={'status': True}, id=id)
+    end = time.monotonic() + deadline
+    interval = confirm_interval
+    while True:
+        client.wake(mac)
+        try:
+            get_result(client.send_request(request, timeout=probe_timeout))
+            break
+        except (requests.ConnectionError, requests.Timeout) as e:
+            remaining = end - time.monotonic()
+            if remaining <= 0: raise RuntimeError(f'No response after waking: {e}') from None
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, confirm_max_interval)
+    deadline = max(end - time.monotonic(), confirm_interval)
+    confirmed, _ = confirm(lambda: get_power_status(client), bool, deadline=deadline)
+    if not confirmed: raise RuntimeError('Power state not confirmed')
+    if mac is None: client.learn_wake_mac()
+    return 'Active'
+
+def set_power(client, status=None, id=1):
+    if status is None:
+        try: status = not get_power_status(client)
+        except (requests.ConnectionError, requests.Timeout, CircuitOpenError): status = True
+    if status: return power_on(client, id=id)
+    request = RESTRequest('system', 'setPowerStatus', params={'status': status}, id=id)
+    get_result(client.send_request(request))
+    confirmed, _ = confirm(lambda: get_power_status(client), lambda current: current == status)
+    if not confirmed: raise RuntimeError('Power state not confirmed')
+    return 'Active' if status else 'Standby'
+
+def set_input(client, name, id=1):
+    uri = find_input(client, name).uri
+    request = RESTRequest('avContent', 'setPlayContent', params={'uri': uri}, id=id)
+    get_result(client.send_request(request))
+    confirmed, _ = confirm(lambda: get_playing_uri(client), lambda playing: playing == uri)
+    if not confirmed: raise RuntimeError('Input not confirmed')
+    return uri
+
+def set_volume(client, volume, target='speaker', id=1):
+    params = {'target': target, 'volume': str(volume)}
+    request = RESTRequest('audio', 'setAudioVolume', params=params, id=id)
+    get_result(client.send_request(request))
+    confirmed, _ = confirm(lambda: get_volume_status(client, target), lambda status: status.volume == volume)
+    if not confirmed: raise RuntimeError('Volume not confirmed')
+    return volume
+
+def set_mute(client, mute, target='speaker', id=1):
+    request = RESTRequest('audio', 'setAudioMute', params={'status': mute}, id=id)
+    get_result(client.send_request(request))
+    confirmed, _ = confirm(lambda: get_volume_status(client, target), lambda status: status.mute == mute)
+    if not confirmed: raise RuntimeError('Mute state not confirmed')
+    return mute
+
+def launch_app(client, name, id=1):
+    app = find_app(client, name)
+    request = RESTRequest('appControl', 'setActiveApp', params={'uri': app.uri}, id=id)
+    get_result(client.send_request(request))
+    return app.title
+
+def terminate_apps(client, id=1):
+    request = RESTRequest('appControl', 'terminateApps', id=id)
+    get_result(client.send_request(request))
+    return 'Terminated'
@@ -0,0 +1,189 @@
+import csv
+import json
+import os
+import re
+import threading
+import time
+from ipaddress import ip_address
+from pathlib import Path
+
+base_path = Path(os.path.realpath(__file__)).parent
+credentials_filename = 'credentials.enc'
+key_filename = 'credentials.key'
+key_env = 'BRAVIA_CONTROL_KEY'
+keyring_service = 'bravia-control'
+auth_ttl = 300.0
+id_keys = ('ip', 'mac', 'serial')
+mac_pattern = re.compile(r'^[0-9a-f]{2}([:-]?[0-9a-f]{2}){5}$')
+
+def normalize(key, value):
+    if value in (None, ''): return None
+    value = str(value).strip()
+    if key == 'ip': return str(ip_address(value))
+    if key == 'mac':
+        digits = re.sub('[^0-9a-f]', '', value.lower())
+        return ':'.join(digits[i:i + 2] for i in range(0, 12, 2))
+    return value
+
+def identify(value):
+    value = value.strip()
+    try: return 'ip', normalize('ip', value)
+    except ValueError: pass
+    if mac_pattern.match(value.lower()): return 'mac', normalize('mac', value)
+    return 'serial', value
+
+def read_credentials_file(path):
+    # Either tvs.txt lines of 'identifier,psk', where the identifier is an IP, MAC or serial number, or a CSV
+    # with a header naming any of the ip, mac and serial columns plus psk.
+    with open(path, newline='') as file:
+        lines = [line for line in file if line.strip()]
+    if lines and 'psk' in [column.strip().lower() for column in lines[0].split(',')]:
+        for row in csv.DictReader(lines):
+            row = {key.strip().lower(): value for key, value in row.items() if key}
+            # Rows without a key or any usable identifier are skipped, as are tvs.txt lines without a key.
+            if not (row.get('psk') or '').strip(): continue
+            try: ids = {key: normalize(key, row.get(key)) for key in id_keys}
+            except ValueError: continue
+            if any(ids.values()): yield {**ids, 'psk': row['psk']}
+        return
+    for line in lines:
+        identifier, _, psk = line.rstrip('\n').partition(',')
+        if '/' in identifier or not psk: continue
+        key, value = identify(identifier)
+        yield {key: value, 'psk': psk}
+
+class CredentialStore:
+    # PSKs encrypted at rest with Fernet. The key comes from $BRAVIA_CONTROL_KEY, then credentials.key,
+    # then the system keyring, and is created in the keyring or credentials.key on first save.
+    def __init__(self, path=base_path/credentials_filename, key_path=base_path/key_filename, ttl=auth_ttl):
+        self.path = path
+        self.key_path = key_path
+        self.ttl = ttl
+        self.entries = []
+        self.index = {}
+        self.auth = {}
+        self.loaded = False
+        self.lock = threading.RLock()
+
+    def get_key(self, create=False):
+        if os.environ.get(key_env): return os.environ[key_env].encode()
+        if self.key_path.is_file(): return self.key_path.read_bytes().strip()
+        try:
+            import keyring
+            key = keyring.get_password(keyring_service, str(self.path))
+            if key is None and create:
+                from cryptography.fernet import Fernet
+                key = Fernet.generate_key().decode()
+                keyring.set_password(keyring_service, str(self.path), key)
+            if key is not None: return key.encode()
+        except Exception:
+            pass
+        if not create: return None
+        from cryptography.fernet import Fernet
+        key = Fernet.generate_key()
+        fd = os.open(self.key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(key)
+        return key
+
+    def get_fernet(self, create=False):
+        # Imported on use, so nothing is loaded when no store exists.
+        from cryptography.fernet import Fernet
+        key = self.get_key(create=create)
+        if key is None: raise ValueError(f'No key to decrypt {self.path.name}. Set ${key_env}.')
+        return Fernet(key)
+
+    def load(self):
+        with self.lock:
+            if self.loaded: return
+            self.loaded = True
+            if not self.path.is_file(): return
+            from cryptography.fernet import InvalidToken
+            try:
+                entries = json.loads(self.get_fernet().decrypt(self.path.read_bytes()))
+            except InvalidToken:
+                raise ValueError(f'{self.path.name} cannot be decrypted with this key') from None
+            for entry in entries: self.add(entry)
+
+    def save(self):
+        with self.lock:
+            token = self.get_fernet(create=True).encrypt(json.dumps(self.entries).encode())
+            temp_path = self.path.with_suffix('.tmp')
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as file:
+                file.write(token)
+            os.replace(temp_path, self.path)
+
+    def add(self, entry):
+        for key in id_keys:
+            if entry.get(key): self.index[key, entry[key]] = entry
+        self.entries.append(entry)
+
+    def find(self, ip=None, mac=None, serial=None):
+        self.load()
+        ids = {'ip': ip, 'mac': mac, 'serial': serial}
+        # The hardware identifiers come first, as an IP may have been handed to another TV.
+        for key in ('serial', 'mac', 'ip'):
+            value = normalize(key, ids[key])
+            if value and (key, value) in self.index: return self.index[key, value]
+        return None
+
+    def resolve(self, tv):
+        entry = self.find(tv.get('ip'), tv.get('mac'), tv.get('serial'))
+        return entry['psk'] if entry else None
+
+    def set(self, psk, ip=None, mac=None, serial=None, save=True):
+        ids = {key: normalize(key, value) for key, value in zip(id_keys, (ip, mac, serial))}
+        if not any(ids.values()): raise ValueError('A PSK needs an IP, MAC or serial number')
+        if psk in (None, ''): raise ValueError('A PSK cannot be empty')
+        with self.lock:
+            self.load()
+            entry = self.find(**ids)
+            if entry is None:
+                entry = {**ids, 'psk': str(psk)}
+                self.add(entry)
+            elif entry['psk'] == str(psk) and all(entry.get(key) == value for key, value in ids.items() if value):
+                return False
+            else:
+                entry['psk'] = str(psk)
+                for key, value in ids.items():
+                    if not value or entry.get(key) == value: continue
+                    # The previous owner of an identifier gives it up, as when DHCP moves an IP.
+                    previous = self.index.get((key, value))
+                    if previous is not None and previous is not entry: previous[key] = None
+                    self.index.pop((key, entry.get(key)), None)
+                    entry[key] = value
+                    self.index[key, value] = entry
+            self.auth.pop(ids['ip'], None)
+            if save: self.save()
+        return True
+
+    def update(self, items):
+        with self.lock:
+            changed = sum(bool(self.set(item['psk'], **{key: item.get(key) for key in id_keys}, save=False))
+                          for item in items)
+            if changed: self.save()
+        return changed
+
+    def remove(self, ip=None, mac=None, serial=None):
+        with self.lock:
+            entry = self.find(ip, mac, serial)
+            if entry is None: return False
+            self.entries = [item for item in self.entries if item is not entry]
+            for key in id_keys: self.index.pop((key, entry.get(key)), None)
+            self.auth.pop(entry.get('ip'), None)
+            self.save()
+        return True
+
+    def get_auth(self, ip, psk):
+        cached = self.auth.get(str(ip))
+        if cached is None or cached[0] != psk or cached[2] < time.monotonic(): return None
+        return cached[1]
+
+    def set_auth(self, ip, psk, ok):
+        self.auth[str(ip)] = (psk, bool(ok), time.monotonic() + self.ttl)
+
+    def clear_auth(self, ip):
+        self.auth.pop(str(ip), None)
+
+credentials = CredentialStore()
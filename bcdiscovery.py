@@ -0,0 +1,196 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from ipaddress import ip_address
+from bcbackend import RESTRequest, base_path, get_tvs, get_client, get_tv_mac, get_tv_serial, get_tv_info, get_rest_port, ssdp_search
+from bcbackend import set_wake_mac, wake_macs, discovery_filename, discovery_lock
+from bccredentials import credentials
+from bcasync import AsyncRESTClient, async_probe_timeout
+
+cached_keys = ['ip', 'modelName', 'productName', 'productCategory', 'serverName', 'interfaceVersion',
+               'mac', 'serial', 'last_seen']
+scan_connect_timeout = 0.3
+scan_concurrency = 512
+scan_rate = 2000
+
+async def probe_port(ip, port=None, timeout=scan_connect_timeout):
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(str(ip), port or get_rest_port()), timeout)
+    except:
+        return False
+    writer.close()
+    try: await writer.wait_closed()
+    except: pass
+    return True
+
+async def scan_networks(network_list, rate=scan_rate, concurrency=scan_concurrency, timeout=scan_connect_timeout):
+    queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def proc_host(ip, psk):
+        try:
+            # A bare TCP connect weeds out empty addresses before paying for a JSON-RPC round-trip.
+            if not await probe_port(ip, timeout=timeout): return
+            client = AsyncRESTClient(ip, psk=psk, retries=0)
+            try:
+                request = RESTRequest('system', 'getInterfaceInformation')
+                response = await client.send_request(request, timeout=async_probe_timeout)
+                tv = get_tv_info(response, {'ip': ip, 'psk': psk})
+            finally:
+                await client.close()
+            if tv: await queue.put(tv)
+        except:
+            pass
+        finally:
+            semaphore.release()
+
+    async def launch():
+        tasks = []
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for item in network_list:
+            for ip in item['network'].hosts():
+                await semaphore.acquire()
+                if rate:
+                    delay = start + len(tasks) / rate - loop.time()
+                    if delay > 0: await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(proc_host(ip, item['psk'])))
+        await asyncio.gather(*tasks)
+        await queue.put(None)
+
+    launcher = asyncio.create_task(launch())
+    while (tv := await queue.get()) is not None:
+        yield tv
+    await launcher
+
+class TVDirectory:
+    def __init__(self, tv_list=None, network_list=None, path=base_path/discovery_filename):
+        self.path = path
+        self.lock = threading.Lock()
+        self.tvs = []
+        self.psks = {tv['ip']: tv['psk'] for tv in tv_list or [] if tv['psk'] is not None}
+        self.tv_list = tv_list or []
+        self.network_list = network_list or []
+        self.thread = None
+        self.scan_thread = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            cached = []
+        tvs = []
+        for tv in cached:
+            try: tv['ip'] = ip_address(tv['ip'])
+            except: continue
+            tv['psk'] = self.get_psk(tv)
+            tv['online'] = None
+            tvs.append(tv)
+        self.merge(tvs, save=False)
+
+    def save(self):
+        with self.lock:
+            cached = [{key: str(tv[key]) if key == 'ip' else tv.get(key) for key in cached_keys} for tv in self.tvs]
+        for tv in cached:
+            # A MAC learnt by a power-on since, which was written to the file, is kept.
+            tv['mac'] = tv['mac'] or wake_macs.get(ip_address(tv['ip']))
+        with discovery_lock:
+            temp_path = self.path.with_suffix('.tmp')
+            with open(temp_path, 'w') as file:
+                json.dump(cached, file, indent=1)
+            os.replace(temp_path, self.path)
+
+    def get_psk(self, tv):
+        # tvs.txt first, then the credential store by IP, MAC or serial, using what earlier runs learnt.
+        psk = self.psks.get(tv['ip'])
+        return psk if psk is not None else credentials.resolve(tv)
+
+    def get(self, ip):
+        ip = ip_address(ip)
+        with self.lock:
+            for tv in self.tvs:
+                if tv['ip'] == ip: return tv
+        return None
+
+    def merge(self, tvs, save=True):
+        changed = False
+        with self.lock:
+            index = {tv['ip']: tv for tv in self.tvs}
+            for tv in tvs:
+                tv = dict(tv)
+                existing = index.get(tv['ip'])
+                if tv.get('psk') is None: tv['psk'] = self.get_psk({**(existing or {}), **tv})
+                set_wake_mac(tv['ip'], tv.get('mac') or (existing or {}).get('mac'))
+                if existing is None:
+                    # Append only, so dropdown indexes already handed to sessions stay valid.
+                    self.tvs.append(tv)
+                    index[tv['ip']] = tv
+                    changed = True
+                    continue
+                update = {key: value for key, value in tv.items() if value is not None and existing.get(key) != value}
+                if update:
+                    existing.update(update)
+                    changed = True
+        if changed and save: self.save()
+        return changed
+
+    def identify(self, tv):
+        # The MAC and serial need a working key. They let the credential store and Wake-on-LAN find the TV again.
+        if tv['psk'] is None: tv['psk'] = self.get_psk({**(self.get(tv['ip']) or {}), **tv})
+        if tv['psk'] is not None:
+            client = get_client(tv['ip'], psk=tv['psk'])
+            tv['mac'] = get_tv_mac(client)
+            tv['serial'] = get_tv_serial(client)
+
+    def discover(self, tv_list=None):
+        started = time.time()
+        with self.lock:
+            known = [{'ip': tv['ip'], 'psk': tv['psk']} for tv in self.tvs]
+        if tv_list is None:
+            tv_list = self.tv_list or ssdp_search()
+        candidates = {tv['ip']: tv for tv in known + list(tv_list)}
+        found = get_tvs(list(candidates.values()))
+        now = time.time()
+        for tv in found:
+            tv['online'] = True
+            tv['last_seen'] = now
+            self.identify(tv)
+        seen = {tv['ip'] for tv in found}
+        missing = {tv['ip'] for tv in known} - seen
+        with self.lock:
+            # Only TVs this pass probed, and not since answered a concurrent scan.
+            for tv in self.tvs:
+                if tv['ip'] in missing and (tv.get('last_seen') or 0) < started: tv['online'] = False
+        self.merge(found)
+        return found
+
+    def discover_in_background(self, tv_list=None):
+        if self.thread is not None and self.thread.is_alive(): return self.thread
+        self.thread = threading.Thread(target=self.discover, args=(tv_list,), daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def scan(self, network_list=None, rate=scan_rate):
+        network_list = self.network_list if network_list is None else network_list
+
+        async def proc_scan():
+            found = []
+            async for tv in scan_networks(network_list, rate=rate):
+                tv['online'] = True
+                tv['last_seen'] = time.time()
+                await asyncio.to_thread(self.identify, tv)
+                self.merge([tv])
+                found.append(tv)
+            return found
+
+        return asyncio.run(proc_scan())
+
+    def scan_in_background(self, network_list=None, rate=scan_rate):
+        if self.scan_thread is not None and self.scan_thread.is_alive(): return self.scan_thread
+        self.scan_thread = threading.Thread(target=self.scan, args=(network_list, rate), daemon=True)
+        self.scan_thread.start()
+        return self.scan_thread
@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from bcbackend import TVState, get_client, get_capabilities, set_power, set_input, set_volume, set_mute, launch_app, terminate_apps
+
+max_workers = 32
+fleet_actions = {
+    'power': lambda client, value, id: set_power(client, value, id=id),
+    'input': lambda client, value, id: set_input(client, value, id=id),
+    'volume': lambda client, value, id: set_volume(client, value, id=id),
+    'mute': lambda client, value, id: set_mute(client, value, id=id),
+    'launch': lambda client, value, id: launch_app(client, value, id=id),
+    'terminate': lambda client, value, id: terminate_apps(client, id=id)
+}
+result_headers = ['ip', 'model', 'action', 'ok', 'latency', 'detail', 'error']
+status_headers = ['ip', 'model', 'online', 'power', 'input', 'volume', 'mute']
+status_methods = [
+    ('system', 'getPowerStatus'),
+    ('avContent', 'getCurrentExternalInputsStatus'),
+    ('avContent', 'getPlayingContentInfo'),
+    ('audio', 'getVolumeInformation')
+]
+
+switch_values = {'on': True, 'true': True, '1': True, 'off': False, 'false': False, '0': False}
+
+def parse_switch(action, value, extra):
+    if isinstance(value, bool): return value
+    key = str(value).lower()
+    if key in switch_values: return switch_values[key]
+    if key in extra: return extra[key]
+    raise ValueError(f'Invalid {action} value: {value!r}')
+
+def parse_value(action, value):
+    if isinstance(value, str): value = value.strip()
+    if action == 'power':
+        if value in (None, ''): return None
+        return parse_switch(action, value, {'toggle': None, 'active': True, 'standby': False})
+    if action == 'mute':
+        if value in (None, ''): raise ValueError('mute needs on or off')
+        return parse_switch(action, value, {'muted': True, 'unmuted': False})
+    if action == 'volume':
+        if value in (None, ''): raise ValueError('volume needs a level')
+        if isinstance(value, bool): raise ValueError(f'Invalid volume value: {value!r}')
+        return int(value)
+    if action in ('input', 'launch'):
+        if value in (None, ''): raise ValueError(f'{action} needs a title')
+        return str(value)
+    return value
+
+def run_fleet(tvs, action, value=None, id=1, max_workers=max_workers):
+    assert action in fleet_actions, f'Unknown action: {action}'
+    value = parse_value(action, value)
+
+    def proc_tv(tv):
+        client = get_client(tv['ip'], psk=tv['psk'])
+        start = perf_counter()
+        detail = None
+        error = None
+        try:
+            try: get_capabilities(client, tv)
+            except Exception:
+                # A TV in deep standby cannot answer until the power action wakes it.
+                if action != 'power': raise
+            detail = fleet_actions[action](client, value, id)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        return {
+            'ip': str(tv['ip']),
+            'model': tv.get('modelName'),
+            'action': action,
+            'ok': error is None,
+            'latency': round(perf_counter() - start, 3),
+            'detail': detail,
+            'error': error
+        }
+
+    if not tvs: return []
+    # One worker per TV keeps a slow panel from queueing behind others, bounded for large fleets.
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tvs))) as pool:
+        return list(pool.map(proc_tv, tvs))
+
+def run_status(tvs, max_workers=max_workers):
+    def proc_tv(tv):
+        state = TVState.fetch(get_client(tv['ip'], psk=tv['psk']), methods=status_methods)
+        speaker = next((item for item in state.volume or [] if item.target == 'speaker'), None)
+        return {
+            'ip': str(tv['ip']),
+            'model': tv.get('modelName'),
+            'online': state.result('getPowerStatus') is not None,
+            'power': state.power_status,
+            'input': state.input.title if state.input else None,
+            'volume': speaker.volume if speaker else None,
+            'mute': speaker.mute if speaker else None
+        }
+
+    if not tvs: return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tvs))) as pool:
+        return list(pool.map(proc_tv, tvs))
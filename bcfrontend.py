@@ -1,23 +1,79 @@
+import asyncio
+import threading
+import time
 import gradio as gr
-from bcbackend import RESTClient, RESTRequest
-from bcbackend import get_auth_status, get_power_status, get_input, get_inputs, get_apps
-from time import sleep
+from bcbackend import RESTRequest, TVState, get_client, get_capabilities, get_cached_apps, invalidate_apps, is_online
+from bcbackend import state_methods, authenticated_state_methods, power_on
+from bccredentials import credentials
+from bcmodels import VolumeInfo
+from bcasync import NotificationWatcher, get_async_client, async_confirm
+from bcasync import async_get_power_status, async_get_playing_uri
+from bcicons import icon_cache
+from bcfleet import fleet_actions, result_headers, run_fleet
+from bcmetrics import traced
+from bcmacros import run_headers, history_headers
+from bcircc import IRCCClient, remote_layout, key_delay
 
-class FrontendGUI:
-    def __init__(self, tvs):
-        self.tvs = tvs
+volume_attempts = 3
+tvs_refresh_interval = 5.0
+status_refresh_interval = 2.0
+session_ttl = 60 * 60
+concurrency_limit = 32
+gallery_stream_interval = 0.25
+
+class Session:
+    def __init__(self):
         self.tvs_index = None
         self.tv = None
         self.client = None
+        self.state = None
         self.auth_status = None
         self._psk = None
+        self.psk_typed = False
         self.id = 1
         self.inputs = None
         self.input = None
         self.power_status = None
+        self.volume_index = None
         self.volume_status = None
         self.apps = None
         self.app_index = None
+        self.gallery_key = None
+
+    @property
+    def psk(self):
+        return self._psk
+
+    @psk.setter
+    def psk(self, psk):
+        self._psk = psk
+        if self.client: self.client = self.client.with_psk(psk)
+
+class SessionStore:
+    def __init__(self, ttl=session_ttl):
+        self.ttl = ttl
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, request):
+        key = request.session_hash if request else None
+        now = time.monotonic()
+        with self.lock:
+            for expired in [k for k, (_, used) in self.sessions.items() if now - used > self.ttl]:
+                del self.sessions[expired]
+            session = self.sessions[key][0] if key in self.sessions else Session()
+            self.sessions[key] = (session, now)
+        return session
+
+class FrontendGUI:
+    def __init__(self, tvs, poller=None, macros=None):
+        # Only the TV list, polled status, icons and capabilities are shared; everything an operator selects
+        # lives in a Session.
+        self.tvs = tvs
+        self.poller = poller
+        self.macros = macros
+        self.sessions = SessionStore()
+        session = Session()
 
         self.tvs_dropdown = None
         self.psk_textbox = None
@@ -29,7 +85,6 @@ class FrontendGUI:
         self.input_button = None
         self.input_textbox = None
         self.volume_dropdown = None
-        self.volume_index = None
         self.volume_slider = None
         self.volume_button = None
         self.volume_textbox = None
@@ -37,7 +92,25 @@ class FrontendGUI:
         self.app_gallery = None
         self.app_launch_button = None
         self.app_terminate_button = None
+        self.fleet_checkboxes = None
+        self.fleet_action_dropdown = None
+        self.fleet_value_textbox = None
+        self.fleet_button = None
+        self.fleet_dataframe = None
+        self.remote_buttons = None
+        self.remote_sequence_textbox = None
+        self.remote_delay_slider = None
+        self.remote_sequence_button = None
+        self.remote_textbox = None
+        self.macro_dropdown = None
+        self.macro_group_dropdown = None
+        self.macro_dry_run_checkbox = None
+        self.macro_button = None
+        self.macro_dataframe = None
+        self.macro_history_dataframe = None
 
+        self.tvs_timer = None
+        self.status_timer = None
         self.components = None
 
         self.launch = None
@@ -52,44 +125,77 @@ class FrontendGUI:
             
             with gr.Row():
                 self.tvs_dropdown = self.get_tvs_dropdown()
-                self.auth_textbox = self.get_auth_textbox()
-                self.psk_textbox = self.get_psk_textbox()
-                self.id_textbox = self.get_id_textbox()
+                self.auth_textbox = self.get_auth_textbox(session)
+                self.psk_textbox = self.get_psk_textbox(session)
+                self.id_textbox = self.get_id_textbox(session)
                 self.refresh_button = self.get_refresh_button()
 
             with gr.Row():
-                self.power_button = self.get_power_button()
-                self.power_textbox = self.get_power_textbox()
+                self.power_button = self.get_power_button(session)
+                self.power_textbox = self.get_power_textbox(session)
             
-            self.inputs_dropdown = self.get_inputs_dropdown()
+            self.inputs_dropdown = self.get_inputs_dropdown(session)
             with gr.Row():
-                self.input_button = self.get_input_button()
-                self.input_textbox = self.get_input_textbox()
+                self.input_button = self.get_input_button(session)
+                self.input_textbox = self.get_input_textbox(session)
 
             with gr.Column():
-                self.volume_dropdown = self.get_volume_dropdown()
-                self.volume_slider = self.get_volume_slider()
+                self.volume_dropdown = self.get_volume_dropdown(session)
+                self.volume_slider = self.get_volume_slider(session)
                 with gr.Row():
-                    self.volume_button = self.get_volume_button()
-                    self.volume_textbox = self.get_volume_textbox()
-                    self.mute_checkbox = self.get_mute_checkbox()
+                    self.volume_button = self.get_volume_button(session)
+                    self.volume_textbox = self.get_volume_textbox(session)
+                    self.mute_checkbox = self.get_mute_checkbox(session)
             
-            self.app_gallery = self.get_app_gallery()
+            self.app_gallery = self.get_app_gallery(session)
             with gr.Row():
-                self.app_launch_button = self.get_app_launch_button()
-                self.app_terminate_button = self.get_app_terminate_button()
+                self.app_launch_button = self.get_app_launch_button(session)
+                self.app_terminate_button = self.get_app_terminate_button(session)
+
+            with gr.Accordion('Fleet Control', open=False):
+                self.fleet_checkboxes = self.get_fleet_checkboxes()
+                with gr.Row():
+                    self.fleet_action_dropdown = self.get_fleet_action_dropdown()
+                    self.fleet_value_textbox = self.get_fleet_value_textbox()
+                    self.fleet_button = self.get_fleet_button()
+                self.fleet_dataframe = self.get_fleet_dataframe()
+
+            with gr.Accordion('Remote', open=False):
+                self.remote_buttons = []
+                for row in remote_layout:
+                    with gr.Row():
+                        self.remote_buttons += [self.get_remote_button(key) for key in row]
+                with gr.Row():
+                    self.remote_sequence_textbox = self.get_remote_sequence_textbox()
+                    self.remote_delay_slider = self.get_remote_delay_slider()
+                    self.remote_sequence_button = self.get_remote_sequence_button()
+                self.remote_textbox = self.get_remote_textbox()
+
+            if self.macros:
+                with gr.Accordion('Macros', open=False):
+                    with gr.Row():
+                        self.macro_dropdown = self.get_macro_dropdown()
+                        self.macro_group_dropdown = self.get_macro_group_dropdown()
+                        self.macro_dry_run_checkbox = self.get_macro_dry_run_checkbox()
+                        self.macro_button = self.get_macro_button()
+                    self.macro_dataframe = self.get_macro_dataframe()
+                    self.macro_history_dataframe = self.get_macro_history_dataframe()
 
             self.components = [self.auth_textbox, self.psk_textbox, self.id_textbox, self.power_button,
                                self.power_textbox, self.inputs_dropdown, self.input_button, self.input_textbox,
                                self.volume_dropdown, self.volume_slider, self.volume_button, self.volume_textbox,
                                self.mute_checkbox, self.app_gallery, self.app_launch_button, self.app_terminate_button]
 
-            self.psk_textbox.submit(self.set_psk_textbox, inputs=self.psk_textbox,
-                                    outputs=[self.tvs_dropdown] + self.components)
-            self.tvs_dropdown.change(self.set_tvs_dropdown, inputs=self.tvs_dropdown, outputs=self.components)
+            events = [
+                self.psk_textbox.submit(self.set_psk_textbox, inputs=self.psk_textbox,
+                                        outputs=[self.tvs_dropdown] + self.components),
+                self.tvs_dropdown.change(self.set_tvs_dropdown, inputs=self.tvs_dropdown, outputs=self.components),
+                self.refresh_button.click(self.set_refresh_button, outputs=self.components),
+                self.power_button.click(self.set_power_button, outputs=self.components)
+            ]
+            for event in events:
+                event.then(self.set_app_gallery_stream, outputs=self.app_gallery)
             self.id_textbox.submit(self.set_id_textbox, inputs=self.id_textbox, outputs=self.id_textbox)
-            self.refresh_button.click(self.set_refresh_button, outputs=self.components)
-            self.power_button.click(self.set_power_button, outputs=self.components)
             self.input_button.click(self.set_input_button, inputs=self.inputs_dropdown,
                                     outputs=[self.inputs_dropdown, self.input_textbox])
             self.volume_dropdown.change(self.set_volume_dropdown, inputs=self.volume_dropdown,
@@ -102,271 +208,537 @@ class FrontendGUI:
             self.app_gallery.select(self.set_app_gallery)
             self.app_launch_button.click(self.set_app_launch_button)
             self.app_terminate_button.click(self.set_app_terminate_button)
+            self.fleet_button.click(self.set_fleet_button, inputs=[self.fleet_checkboxes, self.fleet_action_dropdown,
+                                                                   self.fleet_value_textbox],
+                                    outputs=self.fleet_dataframe)
+            for button in self.remote_buttons:
+                # Skips the queue, since a key press is one short request and must not wait behind a refresh.
+                button.click(self.set_remote_button, inputs=button, outputs=self.remote_textbox, queue=False)
+            self.remote_sequence_button.click(self.set_remote_sequence_button,
+                                              inputs=[self.remote_sequence_textbox, self.remote_delay_slider],
+                                              outputs=self.remote_textbox)
+            if self.macros:
+                self.macro_button.click(self.set_macro_button, inputs=[self.macro_dropdown, self.macro_group_dropdown,
+                                                                       self.macro_dry_run_checkbox],
+                                        outputs=[self.macro_dataframe, self.macro_history_dataframe])
 
+            # Discovery keeps appending to self.tvs in the background, so keep the TV pickers current.
+            self.tvs_timer = gr.Timer(tvs_refresh_interval)
+            self.tvs_timer.tick(self.set_tvs_timer, outputs=[self.tvs_dropdown, self.fleet_checkboxes])
+
+            if self.poller:
+                self.status_timer = gr.Timer(status_refresh_interval)
+                self.status_timer.tick(self.set_status_timer, outputs=[self.power_textbox, self.input_textbox,
+                                                                       self.volume_textbox, self.mute_checkbox])
+
+            interface.queue(default_concurrency_limit=concurrency_limit)
             self.launch = interface.launch
-    
-    @property
-    def psk(self):
-        return self._psk
 
-    @psk.setter
-    def psk(self, psk):
-        self._psk = psk
-        if self.client: self.client.psk = psk
+    def get_tv_label(self, tv, with_ip=False):
+        label = f'{tv["modelName"]} ({tv["ip"]})' if with_ip else tv['modelName']
+        if tv.get('online') is False or not is_online(tv['ip']): label += ' (offline)'
+        return label
+
+    def get_tv_choices(self, with_ip=False):
+        # The index is the value, so a selection survives its label changing, as when a TV goes offline.
+        return [(self.get_tv_label(tv, with_ip=with_ip), i) for i, tv in enumerate(self.tvs)]
 
     def get_tvs_dropdown(self):
-        choices = [i['modelName'] for i in self.tvs]
-        return gr.Dropdown(choices=choices, label='Available TVs', type='index',
-                           interactive=True, scale=2)
+        return gr.Dropdown(choices=self.get_tv_choices(), label='Available TVs', interactive=True, scale=2)
     
-    def refresh_interface(self):
-        return [self.get_auth_textbox(), self.get_psk_textbox(), self.get_id_textbox(),
-                self.get_power_button(), self.get_power_textbox(), self.get_inputs_dropdown(),
-                self.get_input_button(), self.get_input_textbox(), self.get_volume_dropdown(),
-                self.get_volume_slider(), self.get_volume_button(), self.get_volume_textbox(),
-                self.get_mute_checkbox(), self.get_app_gallery(), self.get_app_launch_button(),
-                self.get_app_terminate_button()]
-
-    def set_tvs_dropdown(self, tvs_index):
-        self.tvs_index = tvs_index
-        if self.tvs_index is None:
-            self.tv = None
-            return self.refresh_interface()
-        self.tv = self.tvs[self.tvs_index]
-        if self.tv['psk'] is not None: self.psk = self.tv['psk']
-        self.client = RESTClient(self.tv['ip'], psk=self.psk)
-        self.auth_status = get_auth_status(self.client)
-        self.power_status = get_power_status(self.client)
-        return self.refresh_interface()
+    @traced
+    def set_tvs_timer(self):
+        tvs_dropdown = gr.Dropdown(choices=self.get_tv_choices())
+        fleet_checkboxes = gr.CheckboxGroup(choices=self.get_tv_choices(with_ip=True))
+        return [tvs_dropdown, fleet_checkboxes]
+
+    @traced
+    def set_status_timer(self, request: gr.Request):
+        # Reads the poller's cache only, so ticks never wait on a TV.
+        session = self.sessions.get(request)
+        outputs = [gr.update(), gr.update(), gr.update(), gr.update()]
+        status = self.poller.get(session.tv['ip']) if session.tv else None
+        if not status or not status['online']:
+            return outputs
+        outputs[0] = gr.Textbox(value='Active' if status['power'] else 'Standby')
+        if not session.auth_status or not status['power']:
+            return outputs
+        input = status['input']
+        value = f'{input.index} : {input.title} : {input.label}' if input else 'No External Input Detected'
+        outputs[1] = gr.Textbox(value=value)
+        volume = status['volume']
+        if volume and session.volume_index is not None and session.volume_index < len(volume):
+            outputs[2] = gr.Textbox(value=volume[session.volume_index].volume)
+            outputs[3] = gr.Checkbox(value=volume[session.volume_index].mute)
+        return outputs
+
+    async def refresh_interface(self, session):
+        session.state = None
+        session.auth_status = None
+        if session.tv: await self.refresh_state(session)
+        session.power_status = session.state.power_status if session.state else None
+        session.volume_status = self.get_volume_status(session)
+        session.apps = None
+        response = session.state.response('getApplicationList') if session.state else None
+        if session.auth_status and session.power_status and response:
+            # Icons already on disk are shown now; the rest are streamed in by set_app_gallery_stream.
+            _, session.apps, _ = get_cached_apps(session.tv['ip'], response)
+            if session.apps: await asyncio.to_thread(self.fill_app_thumbnails, session.apps)
+        return [self.get_auth_textbox(session), self.get_psk_textbox(session), self.get_id_textbox(session),
+                self.get_power_button(session), self.get_power_textbox(session), self.get_inputs_dropdown(session),
+                self.get_input_button(session), self.get_input_textbox(session), self.get_volume_dropdown(session),
+                self.get_volume_slider(session), self.get_volume_button(session), self.get_volume_textbox(session),
+                self.get_mute_checkbox(session), self.get_app_gallery_update(session), self.get_app_launch_button(session),
+                self.get_app_terminate_button(session)]
+
+    async def refresh_state(self, session):
+        # A key known to work skips the getNetworkSettings check until the cached result expires. Any 403
+        # drops it early.
+        ip = session.tv['ip']
+        auth = credentials.get_auth(ip, session.psk)
+        methods = state_methods if auth is None else authenticated_state_methods
+        session.state = await TVState.afetch(session.client, id=session.id, methods=methods)
+        if auth is not None:
+            session.auth_status = auth and not session.state.forbidden
+            if session.auth_status != auth: credentials.clear_auth(ip)
+            return
+        session.auth_status = session.state.auth_status
+        if session.auth_status and session.psk:
+            # Remember a working key, so the next selection of this TV needs no typing.
+            session.tv['psk'] = session.psk
+            await asyncio.to_thread(credentials.set, session.psk, ip=ip, mac=session.tv.get('mac'),
+                                    serial=session.tv.get('serial'))
+        credentials.set_auth(ip, session.psk, session.auth_status)
+
+    @traced
+    async def set_tvs_dropdown(self, tvs_index, request: gr.Request):
+        session = self.sessions.get(request)
+        session.tvs_index = tvs_index
+        if session.tvs_index is None:
+            session.tv = None
+            return await self.refresh_interface(session)
+        session.tv = self.tvs[session.tvs_index]
+        psk = session.tv['psk'] if session.tv['psk'] is not None else credentials.resolve(session.tv)
+        if psk is not None:
+            session.psk = psk
+            session.psk_typed = False
+        session.client = get_async_client(session.tv['ip']).with_psk(session.psk)
+        try: await asyncio.to_thread(get_capabilities, get_client(session.tv['ip']), session.tv)
+        except: pass
+        return await self.refresh_interface(session)
     
-    def get_auth_textbox(self):
+    def get_auth_textbox(self, session):
         value = 'N/A'
-        if self.tv: value = 'Passed' if self.auth_status else 'Failed'
+        if session.tv: value = 'Passed' if session.auth_status else 'Failed'
         return gr.Textbox(label='Authentication Status', value=value, interactive=False)
     
-    def get_id_textbox(self):
+    def get_id_textbox(self, session):
             value = 1
-            if self.id: value = self.id
+            if session.id: value = session.id
             return gr.Textbox(label='Access ID', value=value, interactive=True)
 
-    def set_id_textbox(self, id):
+    @traced
+    def set_id_textbox(self, id, request: gr.Request):
+        session = self.sessions.get(request)
         try: id = int(id)
         except: id = 1
         if id <= 0: id = 1
-        self.id = id
+        session.id = id
         return gr.Textbox(label='Access ID', value=id, interactive=True)
 
     def get_refresh_button(self):
         return gr.Button(value='Refresh', interactive=True)
 
-    def set_refresh_button(self):
-        return self.refresh_interface()
+    @traced
+    async def set_refresh_button(self, request: gr.Request):
+        session = self.sessions.get(request)
+        if session.tv: invalidate_apps(session.tv['ip'])
+        return await self.refresh_interface(session)
 
-    def get_psk_textbox(self):
-        return gr.Textbox(label='Pre-Shared Key', value=self.psk, type='password',
+    def get_psk_textbox(self, session):
+        # Keys from tvs.txt or the credential store stay on the server; only a key the user typed is sent back.
+        value = session.psk if session.psk_typed else ''
+        placeholder = 'Stored key' if session.psk and not session.psk_typed else None
+        return gr.Textbox(label='Pre-Shared Key', value=value, placeholder=placeholder, type='password',
                            interactive=True)
     
-    def set_psk_textbox(self, psk):
-        self.psk = psk
-        if self.tv: self.auth_status = get_auth_status(self.client)
+    @traced
+    async def set_psk_textbox(self, psk, request: gr.Request):
+        session = self.sessions.get(request)
+        if psk:
+            session.psk = psk
+            session.psk_typed = True
+        elif session.tv:
+            # An empty box goes back to the stored key.
+            session.psk = session.tv['psk'] if session.tv['psk'] is not None else credentials.resolve(session.tv)
+            session.psk_typed = False
+        else:
+            session.psk = None
+            session.psk_typed = False
+        if session.tv: credentials.clear_auth(session.tv['ip'])
         tvs_dropdown = self.get_tvs_dropdown()
-        return [tvs_dropdown] + self.refresh_interface()
+        return [tvs_dropdown] + await self.refresh_interface(session)
     
-    def get_power_button(self):
-        interactive = self.auth_status
+    def get_power_button(self, session):
+        interactive = session.auth_status
         return gr.Button(value='Toggle Power', interactive=interactive)
 
-    def set_power_button(self):
-        status = get_power_status(self.client)
-        set_request = RESTRequest('system', 'setPowerStatus', params={'status': not status}, id=self.id)
-        _ = self.client.send_request(set_request)
-        sleep(5.0)
-        self.power_status = get_power_status(self.client)
-        return self.refresh_interface()
+    @traced
+    async def set_power_button(self, request: gr.Request):
+        session = self.sessions.get(request)
+        client = session.client
+        try: target = not await async_get_power_status(client)
+        except Exception: target = True
+        if target:
+            # Powering on goes through the wake pipeline, which also reaches TVs in deep standby.
+            try: await asyncio.to_thread(power_on, get_client(session.tv['ip']).with_psk(session.psk), session.id)
+            except RuntimeError: pass
+            return await self.refresh_interface(session)
+        async with NotificationWatcher(client, 'system', 'notifyPowerStatus',
+                                       parse=lambda params: params['status'] == 'active') as watcher:
+            set_request = RESTRequest('system', 'setPowerStatus', params={'status': target}, id=session.id)
+            _ = await client.send_request(set_request)
+            await async_confirm(lambda: async_get_power_status(client), lambda status: status == target,
+                                watcher=watcher)
+        return await self.refresh_interface(session)
 
-    def get_power_textbox(self):
-        if not self.tv:
+    def get_power_textbox(self, session):
+        if not session.tv:
             value = 'No TV Selected.'
         else:
-            status = get_power_status(self.client)
-            value = 'Active' if status else 'Standby'
+            value = 'Active' if session.power_status else 'Standby'
         return gr.Textbox(value=value, label='Current Power State', interactive=False)
     
-    def get_inputs_dropdown(self):
-        if not self.tv or not self.power_status:
+    def get_inputs_dropdown(self, session):
+        session.inputs = session.state.inputs if session.tv and session.power_status else None
+        if not session.inputs:
             choices = ['No TV Selected.']
             value = choices[0]
             interactive = False
         else:
-            inputs_request = RESTRequest('avContent', 'getCurrentExternalInputsStatus', ver=1.0, id=self.id)
-            inputs_response = self.client.send_request(inputs_request)
-            self.inputs = get_inputs(inputs_response)
-            choices = [f'{item["index"]} : {item["title"]} : {item["label"]}' for item in self.inputs]
+            choices = [f'{item.index} : {item.title} : {item.label}' for item in session.inputs]
             value = choices[0]
-            input_request = RESTRequest('avContent', 'getPlayingContentInfo', id=self.id)
-            input_response = self.client.send_request(input_request)
-            input = get_input(input_response, inputs_response)
-            if input: value = f'{input["index"]} : {input["title"]} : {input["label"]}'
+            input = session.state.input
+            if input: value = f'{input.index} : {input.title} : {input.label}'
             interactive = True
         return gr.Dropdown(choices=choices, value=value, label='Inputs',
                            interactive=interactive, type='index')
     
-    def get_input_button(self):
-        interactive = self.auth_status and self.power_status
+    def get_input_button(self, session):
+        interactive = session.auth_status and session.power_status
         return gr.Button(value='Set Input', interactive=interactive)
 
-    def set_input_button(self, input_index):
-        uri = self.inputs[input_index]['uri']
-        set_request = RESTRequest('avContent', 'setPlayContent', params={'uri': uri}, id=self.id)
-        _ = self.client.send_request(set_request)
-        sleep(5.0)
-        self.input = self.inputs[input_index]
-        inputs_dropdown = self.get_inputs_dropdown()
-        input_textbox = self.get_input_textbox()
+    @traced
+    async def set_input_button(self, input_index, request: gr.Request):
+        session = self.sessions.get(request)
+        client = session.client
+        uri = session.inputs[input_index].uri
+        async with NotificationWatcher(client, 'avContent', 'notifyPlayingContentInfo',
+                                       parse=lambda params: params.get('uri')) as watcher:
+            set_request = RESTRequest('avContent', 'setPlayContent', params={'uri': uri}, id=session.id)
+            _ = await client.send_request(set_request)
+            await async_confirm(lambda: async_get_playing_uri(client), lambda playing: playing == uri,
+                                watcher=watcher)
+        session.input = session.inputs[input_index]
+        await session.state.aupdate(client, id=session.id, methods=[('avContent', 'getCurrentExternalInputsStatus'),
+                                                                    ('avContent', 'getPlayingContentInfo')])
+        inputs_dropdown = self.get_inputs_dropdown(session)
+        input_textbox = self.get_input_textbox(session)
         return [inputs_dropdown, input_textbox]
     
-    def get_input_textbox(self):
-        if not self.tv or not self.auth_status:
+    def get_input_textbox(self, session):
+        if not session.tv or not session.auth_status:
             value = 'No TV Selected or Unauthorized'
         else:
             value = 'No External Input Detected'
-            input_request = RESTRequest('avContent', 'getPlayingContentInfo', id=self.id)
-            input_response = self.client.send_request(input_request)
-            inputs_request = RESTRequest('avContent', 'getCurrentExternalInputsStatus', ver=1.0, id=self.id)
-            inputs_response = self.client.send_request(inputs_request)
-            input = get_input(input_response, inputs_response)
-            if input: value = f'{input["index"]} : {input["title"]} : {input["label"]}'
+            input = session.state.input
+            if input: value = f'{input.index} : {input.title} : {input.label}'
         return gr.Textbox(value=value, label='Current Input', interactive=False)
     
-    def get_volume_dropdown(self):
+    def get_volume_dropdown(self, session):
         choices = ['No Target(s) Available']
         interactive = False
-        if self.auth_status:
-            request = RESTRequest('audio', 'getVolumeInformation', id=self.id)
-            response = self.client.send_request(request)
-            result = response.data.get('result')
+        if session.auth_status:
+            result = session.state.volume
             if result:
-                result = result[0]
-                choices = [item['target'].capitalize() for item in result]
+                choices = [item.target.capitalize() for item in result]
                 interactive = True
         return gr.Dropdown(choices=choices, value=choices[0], label='Volume Target',
                            interactive=interactive, type='index')
     
-    def set_volume_dropdown(self, volume_index):
-        request = RESTRequest('audio', 'getVolumeInformation', id=self.id)
-        response = self.client.send_request(request)
-        self.volume_index = None
-        self.volume_status = None
-        if response.data.get('result'):
-            result = response.data['result'][0]
-            self.volume_index = volume_index
-            self.volume_status = result[volume_index]
-        volume_slider = self.get_volume_slider()
-        volume_button = self.get_volume_button()
-        volume_textbox = self.get_volume_textbox()
-        mute_checkbox = self.get_mute_checkbox()
+    @traced
+    def set_volume_dropdown(self, volume_index, request: gr.Request):
+        session = self.sessions.get(request)
+        session.volume_index = volume_index
+        session.volume_status = self.get_volume_status(session)
+        volume_slider = self.get_volume_slider(session)
+        volume_button = self.get_volume_button(session)
+        volume_textbox = self.get_volume_textbox(session)
+        mute_checkbox = self.get_mute_checkbox(session)
         return [volume_slider, volume_button, volume_textbox, mute_checkbox]
     
-    def get_volume_slider(self):
+    def get_volume_slider(self, session):
         value = 0
         minimum = 0
         maximum = 100
         interactive = False
-        if self.auth_status and self.volume_status:
-            self.volume_status = self.set_volume_status()
-            if self.volume_status:
-                value = self.volume_status['volume']
-                minimum = self.volume_status['minVolume']
-                maximum = self.volume_status['maxVolume']
-                interactive = True
+        if session.auth_status and session.volume_status:
+            value = session.volume_status.volume
+            minimum = session.volume_status.min_volume
+            maximum = session.volume_status.max_volume
+            interactive = True
         return gr.Slider(value=value, minimum=minimum, maximum=maximum,
                          label='Target Volume', interactive=interactive)
     
-    def get_volume_button(self):
-        interactive = self.auth_status and bool(self.volume_status)
+    def get_volume_button(self, session):
+        interactive = session.auth_status and bool(session.volume_status)
         return gr.Button(value='Set Volume', interactive=interactive)
     
-    def set_volume_button(self, volume):
-        interactive = self.auth_status and bool(self.volume_status)
+    @traced
+    async def set_volume_button(self, volume, request: gr.Request):
+        session = self.sessions.get(request)
+        interactive = session.auth_status and bool(session.volume_status)
         if interactive:
+            target = session.volume_status.target
             params = {
-                'target': self.volume_status['target'],
+                'target': target,
                 'volume': str(volume),
                 #'ui': None
             }
-            while self.volume_status['volume'] != volume:
-                request = RESTRequest('audio', 'setAudioVolume', params=params, ver=1.0, id=self.id)
-                _ = self.client.send_request(request)
-                sleep(1.0)
-                self.volume_status = self.set_volume_status()
-        volume_slider = self.get_volume_slider()
-        volume_textbox = self.get_volume_textbox()
+            async with NotificationWatcher(session.client, 'audio', 'notifyVolumeInformation',
+                                           parse=VolumeInfo.parse) as watcher:
+                for _ in range(volume_attempts):
+                    api_request = RESTRequest('audio', 'setAudioVolume', params=params, id=session.id)
+                    _ = await session.client.send_request(api_request)
+                    confirmed, _ = await async_confirm(
+                        lambda: self.set_volume_status(session), watcher=watcher,
+                        predicate=lambda status: status.target == target and status.volume == volume)
+                    if confirmed: break
+            session.volume_status = await self.set_volume_status(session)
+        volume_slider = self.get_volume_slider(session)
+        volume_textbox = self.get_volume_textbox(session)
         return [volume_slider, volume_textbox]
     
-    def get_volume_textbox(self):
+    def get_volume_textbox(self, session):
         value = 'N/A'
-        if self.auth_status and self.volume_status:
-            self.volume_status = self.set_volume_status()
-            if self.volume_status:
-                value = self.volume_status['volume']
+        if session.auth_status and session.volume_status:
+            value = session.volume_status.volume
         return gr.Textbox(value=value, label='Current Volume', interactive=False)
     
-    def get_mute_checkbox(self):
+    def get_mute_checkbox(self, session):
         value = False
-        interactive = bool(self.tv) and self.auth_status and bool(self.volume_status)
+        interactive = bool(session.tv) and session.auth_status and bool(session.volume_status)
         if interactive:
-            self.volume_status = self.set_volume_status()
-            if self.volume_status:
-                value = self.volume_status['mute']
+            value = session.volume_status.mute
         return gr.Checkbox(value=value, label='Muted', info='Current Mute State',
                            interactive=interactive)
             
-    def set_mute_checkbox(self, mute):
-        interactive = self.auth_status and bool(self.volume_status)
+    @traced
+    async def set_mute_checkbox(self, mute, request: gr.Request):
+        session = self.sessions.get(request)
+        interactive = session.auth_status and bool(session.volume_status)
         if interactive:
-            request = RESTRequest('audio', 'setAudioMute', params={'status': mute}, id=self.id)
-            _ = self.client.send_request(request)
-            self.volume_status = self.set_volume_status()
-            if self.volume_status:
-                mute = self.volume_status['mute']
+            target = session.volume_status.target
+            async with NotificationWatcher(session.client, 'audio', 'notifyVolumeInformation',
+                                           parse=VolumeInfo.parse) as watcher:
+                api_request = RESTRequest('audio', 'setAudioMute', params={'status': mute}, id=session.id)
+                _ = await session.client.send_request(api_request)
+                await async_confirm(lambda: self.set_volume_status(session), watcher=watcher,
+                                    predicate=lambda status: status.target == target and status.mute == mute)
+            session.volume_status = await self.set_volume_status(session)
+            if session.volume_status:
+                mute = session.volume_status.mute
         return gr.Checkbox(value=mute, label='Muted', info='Current Mute State',
                            interactive=interactive)
     
-    def set_volume_status(self):
-        request = RESTRequest('audio', 'getVolumeInformation', id=self.id)
-        response = self.client.send_request(request)
-        if response.data.get('result'):
-            result = response.data['result'][0]
-            status = result[self.volume_index]
-            return status
+    async def set_volume_status(self, session):
+        if not session.state: return None
+        await session.state.aupdate(session.client, id=session.id, methods=[('audio', 'getVolumeInformation')])
+        return self.get_volume_status(session)
+
+    def get_volume_status(self, session):
+        if not session.state or session.volume_index is None: return None
+        result = session.state.volume
+        if result and session.volume_index < len(result):
+            return result[session.volume_index]
         return None
     
-    def get_app_gallery(self):
+    def get_app_gallery(self, session):
         value = None
-        self.apps = None
-        if self.auth_status and self.power_status:
-            self.apps = get_apps(self.client)
-            value = [(item['cached_icon_path'], item['title']) for item in self.apps]
+        if session.apps:
+            placeholder = icon_cache.thumbnail(icon_cache.placeholder)
+            value = [(item.thumbnail or placeholder, item.title) for item in session.apps]
+        session.gallery_key = self.get_gallery_key(session)
         return gr.Gallery(value=value, label='Apps', allow_preview=False,
                            object_fit='scale-down', columns=9)
+
+    def get_gallery_key(self, session):
+        return tuple((item.title, item.thumbnail) for item in session.apps) if session.apps else None
+
+    def get_app_gallery_update(self, session):
+        # An unchanged gallery is not sent again, so periodic refreshes cost no image traffic.
+        if session.gallery_key == self.get_gallery_key(session): return gr.update()
+        return self.get_app_gallery(session)
+
+    def fill_app_thumbnails(self, apps):
+        for app in apps:
+            if app.thumbnail is None:
+                app.thumbnail = icon_cache.peek_thumbnail(app.icon)
+
+    @traced
+    async def set_app_gallery_stream(self, request: gr.Request):
+        session = self.sessions.get(request)
+        apps = session.apps
+        pending = [app for app in apps or [] if app.thumbnail is None]
+        if not pending:
+            yield gr.update()
+            return
+
+        async def proc_app(app):
+            future = icon_cache.pool.submit(icon_cache.get_thumbnail, app.icon)
+            app.thumbnail = await asyncio.wrap_future(future)
+
+        last = time.monotonic()
+        for task in asyncio.as_completed([proc_app(app) for app in pending]):
+            await task
+            # Stop if the operator moved to another TV or the list changed underneath.
+            if session.apps is not apps: return
+            if time.monotonic() - last >= gallery_stream_interval:
+                last = time.monotonic()
+                yield self.get_app_gallery(session)
+        await asyncio.to_thread(icon_cache.save_index)
+        yield self.get_app_gallery_update(session)
         
-    def set_app_gallery(self, evt: gr.SelectData):
-        self.app_index = evt.index
+    @traced
+    def set_app_gallery(self, evt: gr.SelectData, request: gr.Request):
+        self.sessions.get(request).app_index = evt.index
     
-    def get_app_launch_button(self):
-        interactive = self.auth_status and bool(self.power_status) and bool(self.apps)
+    def get_app_launch_button(self, session):
+        interactive = session.auth_status and bool(session.power_status) and bool(session.apps)
         return gr.Button(value='Launch Selected App', interactive=interactive)
     
-    def get_app_terminate_button(self):
-        interactive = self.auth_status and bool(self.power_status)
+    def get_app_terminate_button(self, session):
+        interactive = session.auth_status and bool(session.power_status)
         return gr.Button(value='Terminate All Apps', interactive=interactive)
     
-    def set_app_launch_button(self):
-        if self.app_index is not None:
-            app_uri = self.apps[self.app_index]['uri']
-            request = RESTRequest('appControl', 'setActiveApp', params={'uri': app_uri}, id=self.id)
-            _ = self.client.send_request(request)
+    @traced
+    async def set_app_launch_button(self, request: gr.Request):
+        session = self.sessions.get(request)
+        if session.app_index is not None:
+            app_uri = session.apps[session.app_index].uri
+            api_request = RESTRequest('appControl', 'setActiveApp', params={'uri': app_uri}, id=session.id)
+            _ = await session.client.send_request(api_request)
     
-    def set_app_terminate_button(self):
-        request = RESTRequest('appControl', 'terminateApps', id=self.id)
-        _ = self.client.send_request(request)
\ No newline at end of file
+    @traced
+    async def set_app_terminate_button(self, request: gr.Request):
+        session = self.sessions.get(request)
+        api_request = RESTRequest('appControl', 'terminateApps', id=session.id)
+        _ = await session.client.send_request(api_request)
+
+    def get_fleet_checkboxes(self):
+        return gr.CheckboxGroup(choices=self.get_tv_choices(with_ip=True), label='Fleet TVs', interactive=True)
+
+    def get_fleet_action_dropdown(self):
+        choices = list(fleet_actions)
+        return gr.Dropdown(choices=choices, value=choices[0], label='Fleet Action', interactive=True)
+
+    def get_fleet_value_textbox(self):
+        return gr.Textbox(label='Action Value', placeholder='on/off/toggle, input title, volume, true/false, app title',
+                          interactive=True, scale=2)
+
+    def get_fleet_button(self):
+        return gr.Button(value='Run On Selected TVs', interactive=True)
+
+    def get_fleet_dataframe(self, results=None):
+        value = [[result[key] for key in result_headers] for result in results or []]
+        return gr.Dataframe(value=value or None, headers=result_headers, label='Fleet Results', interactive=False)
+
+    @traced
+    async def set_fleet_button(self, tv_indexes, action, value, request: gr.Request):
+        session = self.sessions.get(request)
+        tvs = [self.tvs[i] for i in tv_indexes or []]
+        try:
+            results = await asyncio.to_thread(run_fleet, tvs, action, value, id=session.id)
+        except (AssertionError, ValueError, AttributeError) as e:
+            raise gr.Error(f'Invalid fleet command: {e}')
+        return self.get_fleet_dataframe(results)
+
+    def get_remote_button(self, key):
+        return gr.Button(value=key, size='sm', min_width=80)
+
+    def get_remote_sequence_textbox(self):
+        return gr.Textbox(label='Key Sequence', placeholder='Home, Down, Down, Confirm', interactive=True, scale=3)
+
+    def get_remote_delay_slider(self):
+        return gr.Slider(minimum=0, maximum=500, step=10, value=int(key_delay * 1000), label='Key Delay (ms)',
+                         interactive=True)
+
+    def get_remote_sequence_button(self):
+        return gr.Button(value='Send Keys', interactive=True)
+
+    def get_remote_textbox(self, value='N/A'):
+        return gr.Textbox(value=value, label='Remote Status', interactive=False)
+
+    def get_ircc_client(self, session):
+        if not session.tv: raise gr.Error('Select a TV first')
+        return IRCCClient(get_client(session.tv['ip']).with_psk(session.psk), session.tv)
+
+    @traced
+    async def set_remote_button(self, key, request: gr.Request):
+        session = self.sessions.get(request)
+        ircc = self.get_ircc_client(session)
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(ircc.send_key, key)
+        except Exception as e:
+            return self.get_remote_textbox(f'{key} failed: {e}')
+        return self.get_remote_textbox(f'{key} sent in {(time.perf_counter() - start) * 1000:.0f} ms')
+
+    @traced
+    async def set_remote_sequence_button(self, sequence, delay, request: gr.Request):
+        session = self.sessions.get(request)
+        ircc = self.get_ircc_client(session)
+        keys = (sequence or '').split(',')
+        start = time.perf_counter()
+        try:
+            sent = await asyncio.to_thread(ircc.send_keys, keys, delay=delay / 1000)
+        except Exception as e:
+            return self.get_remote_textbox(f'Sequence failed: {e}')
+        return self.get_remote_textbox(f'{len(sent)} keys sent in {(time.perf_counter() - start) * 1000:.0f} ms')
+
+    def get_macro_dropdown(self):
+        choices = list(self.macros.macros)
+        return gr.Dropdown(choices=choices, value=choices[0] if choices else None, label='Macro', interactive=True)
+
+    def get_macro_group_dropdown(self):
+        choices = ['all'] + list(self.macros.config['groups'])
+        return gr.Dropdown(choices=choices, value='all', label='TV Group', interactive=True)
+
+    def get_macro_dry_run_checkbox(self):
+        return gr.Checkbox(value=True, label='Dry Run', interactive=True)
+
+    def get_macro_button(self):
+        return gr.Button(value='Run Macro', interactive=True)
+
+    def get_macro_dataframe(self, run=None):
+        value = []
+        for result in run['results'] if run else []:
+            failed = next((step for step in result['steps'] if not step['ok']), None)
+            value.append([result['ip'], result['model'], result['ok'], result['latency'],
+                          failed['step'] if failed else None, failed['error'] if failed else None])
+        return gr.Dataframe(value=value or None, headers=run_headers, label='Macro Results', interactive=False)
+
+    def get_macro_history_dataframe(self):
+        value = [[time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run['started'])), run['macro'], run['group'],
+                  run['trigger'], run['dry_run'], run['ok'], len(run['results']),
+                  sum(not result['ok'] for result in run['results'])] for run in reversed(self.macros.history)]
+        return gr.Dataframe(value=value or None, headers=history_headers, label='Macro History', interactive=False)
+
+    @traced
+    async def set_macro_button(self, name, group, dry_run, request: gr.Request):
+        session = self.sessions.get(request)
+        try:
+            run = await asyncio.to_thread(self.macros.run, name, group=group, dry_run=dry_run, id=session.id)
+        except ValueError as e:
+            raise gr.Error(f'Invalid macro: {e}')
+        return [self.get_macro_dataframe(run), self.get_macro_history_dataframe()]
@@ -0,0 +1,175 @@
+import functools
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from pathlib import Path, PurePosixPath
+from urllib.parse import urlparse
+import requests
+
+base_path = Path(os.path.realpath(__file__)).parent
+cache_path = base_path/'iconcache'
+index_filename = 'index.json'
+placeholder_filename = 'placeholder.png'
+max_cache_bytes = 64 * 1024 * 1024
+revalidate_after = 24 * 60 * 60
+max_workers = 16
+timeout = (3.05, 10.0)
+thumbnail_size = 128
+
+@functools.cache
+def get_thumbnail_format():
+    try:
+        from PIL import features
+        return 'webp' if features.check('webp') else 'png'
+    except ImportError:
+        return 'png'
+
+class IconCache:
+    def __init__(self, path=cache_path, max_bytes=max_cache_bytes, revalidate_after=revalidate_after,
+                 max_workers=max_workers):
+        self.path = path
+        self.index_path = path/index_filename
+        self.placeholder = str(path/placeholder_filename)
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.lock = threading.RLock()
+        self.session = requests.Session()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.revalidating = set()
+        self.index = self.load_index()
+
+    def load_index(self):
+        try:
+            with open(self.index_path) as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        return {url: entry for url, entry in index.items() if (self.path/entry['file']).is_file()}
+
+    def save_index(self):
+        with self.lock:
+            data = json.dumps(self.index)
+            temp_path = self.index_path.with_suffix('.tmp')
+            with open(temp_path, 'w') as file:
+                file.write(data)
+            os.replace(temp_path, self.index_path)
+
+    def get(self, url):
+        with self.lock:
+            entry = self.index.get(url)
+            if entry and (self.path/entry['file']).is_file():
+                entry['used'] = time.time()
+                if time.time() - entry['checked'] > self.revalidate_after:
+                    self.revalidate_later(url)
+                return str(self.path/entry['file'])
+        try:
+            return self.download(url)
+        except:
+            return self.placeholder
+
+    def peek(self, url):
+        with self.lock:
+            entry = self.index.get(url)
+            if entry and (self.path/entry['file']).is_file(): return str(self.path/entry['file'])
+        return None
+
+    def thumbnail(self, path, size=thumbnail_size):
+        # Downscaled once per icon and size, so the browser gets gallery-sized images instead of full icons.
+        source = Path(path)
+        target = source.with_name(f'{source.stem}.{size}.{get_thumbnail_format()}')
+        if target.is_file(): return str(target)
+        try:
+            from PIL import Image
+            with Image.open(source) as image:
+                image = image.convert('RGBA')
+                image.thumbnail((size, size))
+                temp_path = target.with_name(f'{target.name}.{threading.get_ident()}.part')
+                image.save(temp_path, format=get_thumbnail_format().upper())
+            os.replace(temp_path, target)
+        except Exception:
+            return str(source)
+        return str(target)
+
+    def get_thumbnail(self, url, size=thumbnail_size):
+        return self.thumbnail(self.get(url), size)
+
+    def peek_thumbnail(self, url, size=thumbnail_size):
+        path = self.peek(url)
+        return self.thumbnail(path, size) if path else None
+
+    def get_many(self, urls):
+        urls = list(dict.fromkeys(urls))
+        paths = dict(zip(urls, self.pool.map(self.get, urls)))
+        self.save_index()
+        return paths
+
+    def revalidate_later(self, url):
+        if url in self.revalidating: return
+        self.revalidating.add(url)
+        self.pool.submit(self.revalidate, url)
+
+    def revalidate(self, url):
+        try:
+            with self.lock:
+                entry = dict(self.index.get(url) or {})
+            self.download(url, entry)
+            self.save_index()
+        except:
+            pass
+        finally:
+            self.revalidating.discard(url)
+
+    def download(self, url, entry=None):
+        headers = {}
+        if entry:
+            if entry.get('etag'): headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'): headers['If-Modified-Since'] = entry['last_modified']
+        response = self.session.get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and entry:
+            with self.lock:
+                self.index[url].update(checked=time.time())
+            return str(self.path/entry['file'])
+        response.raise_for_status()
+        data = response.content
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+        extension = PurePosixPath(urlparse(url).path).suffix or mimetypes.guess_extension(content_type) or ''
+        # Files are named by content digest, so identical icons served from different URLs share one file.
+        filename = hashlib.sha256(data).hexdigest() + extension.lower()
+        file_path = self.path/filename
+        if not file_path.is_file():
+            temp_path = file_path.with_name(f'{filename}.{threading.get_ident()}.part')
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, file_path)
+        now = time.time()
+        with self.lock:
+            self.index[url] = {
+                'file': filename,
+                'size': len(data),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified') or formatdate(now, usegmt=True),
+                'checked': now,
+                'used': now
+            }
+            self.evict()
+        return str(file_path)
+
+    def evict(self):
+        with self.lock:
+            sizes = {entry['file']: entry['size'] for entry in self.index.values()}
+            total = sum(sizes.values())
+            for url, entry in sorted(self.index.items(), key=lambda item: item[1]['used']):
+                if total <= self.max_bytes: break
+                del self.index[url]
+                if any(other['file'] == entry['file'] for other in self.index.values()): continue
+                total -= sizes[entry['file']]
+                for file_path in [self.path/entry['file']] + list(self.path.glob(f'{Path(entry["file"]).stem}.*')):
+                    try: os.remove(file_path)
+                    except OSError: pass
+
+icon_cache = IconCache()
@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+import time
+from bcbackend import RESTRequest, base_path, get_result, probe_timeout
+from bcmetrics import timed_request
+
+ircc_filename = 'remote_codes.json'
+ircc_service = 'IRCC'
+key_delay = 0.05
+key_timeout = (1.0, 2.0)
+ircc_envelope = ('<?xml version="1.0"?>'
+                 '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+                 's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>'
+                 '<u:X_SendIRCC xmlns:u="urn:schemas-sony-com:service:IRCC:1"><IRCCCode>{}</IRCCCode></u:X_SendIRCC>'
+                 '</s:Body></s:Envelope>')
+ircc_headers = {'Content-Type': 'text/xml; charset=UTF-8',
+                'SOAPACTION': '"urn:schemas-sony-com:service:IRCC:1#X_SendIRCC"'}
+remote_layout = [
+    ['PowerOff', 'Input', 'Home', 'Return'],
+    ['Options', 'Up', 'ActionMenu'],
+    ['Left', 'Confirm', 'Right'],
+    ['Rewind', 'Down', 'Forward'],
+    ['VolumeDown', 'Mute', 'VolumeUp'],
+    ['ChannelDown', 'Play', 'Pause', 'ChannelUp']
+]
+
+remote_codes = {}
+remote_codes_lock = threading.Lock()
+
+def read_remote_codes():
+    try:
+        with open(base_path/ircc_filename) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def write_remote_codes(cached):
+    codes_path = base_path/ircc_filename
+    temp_path = codes_path.with_suffix('.tmp')
+    with open(temp_path, 'w') as file:
+        json.dump(cached, file, indent=1)
+    os.replace(temp_path, codes_path)
+
+def get_remote_codes(client, tv=None):
+    if client.ip in remote_codes:
+        return remote_codes[client.ip]
+    if tv is None or 'modelName' not in tv:
+        request = RESTRequest('system', 'getInterfaceInformation')
+        tv = get_result(client.send_request(request, timeout=probe_timeout))[0]
+    # Code tables only change with the model and firmware, so they are fetched once per model.
+    key = f'{tv["modelName"]}/{tv.get("interfaceVersion")}'
+    with remote_codes_lock:
+        cached = read_remote_codes()
+        if key in cached:
+            remote_codes[client.ip] = cached[key]
+            return cached[key]
+    request = RESTRequest('system', 'getRemoteControllerInfo')
+    result = get_result(client.send_request(request, timeout=probe_timeout))
+    codes = {item['name']: item['value'] for item in result[1]}
+    with remote_codes_lock:
+        cached = read_remote_codes()
+        cached[key] = codes
+        write_remote_codes(cached)
+        remote_codes[client.ip] = codes
+    return codes
+
+class IRCCClient:
+    def __init__(self, client, tv=None):
+        # Reuses the JSON-RPC client's pooled keep-alive connections, so keys skip the TCP handshake.
+        self.client = client
+        self.tv = tv
+        self.url = client.base_url + ircc_service
+
+    @property
+    def codes(self):
+        return get_remote_codes(self.client, self.tv)
+
+    def get_code(self, key):
+        codes = self.codes
+        if key in codes: return codes[key]
+        lowered = {name.lower(): code for name, code in codes.items()}
+        if key.lower() in lowered: return lowered[key.lower()]
+        raise ValueError(f'Unknown remote key: {key}')
+
+    def send_key(self, key):
+        code = self.get_code(key)
+        headers = {**ircc_headers, 'X-Auth-PSK': self.client.psk}
+        with timed_request(self.client.ip, RESTRequest(ircc_service, key)) as call:
+            response = self.client.session.post(self.url, data=ircc_envelope.format(code), headers=headers,
+                                                timeout=key_timeout)
+            call['status'] = response.status_code
+            call['bytes'] = len(response.content)
+        if response.status_code != 200: raise RuntimeError(f'HTTP {response.status_code}: {key} not sent')
+        return key
+
+    def send_keys(self, keys, delay=key_delay):
+        keys = [key.strip() for key in keys if key.strip()]
+        for key in keys: self.get_code(key)
+        # One key at a time on the pooled connection, so they always arrive in order. The delay is counted
+        # from when the previous key was sent, so a reply that comes back within it costs no extra time.
+        sent = []
+        next_send = time.monotonic()
+        for key in keys:
+            wait = next_send - time.monotonic()
+            if wait > 0: time.sleep(wait)
+            next_send = time.monotonic() + delay
+            sent.append(self.send_key(key))
+        return sent
@@ -0,0 +1,236 @@
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from ipaddress import ip_address
+from time import perf_counter
+from bcbackend import RESTRequest, base_path, get_client, get_result, confirm
+from bccredentials import credentials
+from bcbackend import get_power_status, get_playing_uri, get_volume_status, find_input
+from bcfleet import fleet_actions, parse_value, max_workers
+
+macros_filename = 'macros.json'
+history_filename = 'macro_history.jsonl'
+history_size = 200
+gate_timeout = 60.0
+run_headers = ['ip', 'model', 'ok', 'latency', 'failed step', 'error']
+history_headers = ['started', 'macro', 'group', 'trigger', 'dry run', 'ok', 'tvs', 'failed']
+cron_fields = [('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7)]
+
+def gate_online(client, value):
+    return lambda: get_power_status(client), lambda status: True
+
+def gate_power(client, value):
+    return lambda: get_power_status(client), lambda status: status == parse_value('power', value)
+
+def gate_input(client, value):
+    # The input list is only readable once the TV is awake, so it is looked up on every check.
+    return lambda: (get_playing_uri(client), find_input(client, value).uri), lambda uris: uris[0] == uris[1]
+
+def gate_volume(client, value):
+    return lambda: get_volume_status(client), lambda status: status.volume == int(value)
+
+wait_gates = {'online': gate_online, 'power': gate_power, 'input': gate_input, 'volume': gate_volume}
+
+def parse_cron_field(field, low, high):
+    values = set()
+    for part in field.split(','):
+        part, _, step = part.partition('/')
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(bound) for bound in part.split('-'))
+        else:
+            start = end = int(part)
+            if step: end = high
+        if not low <= start <= end <= high: raise ValueError(f'Cron value out of range: {field}')
+        values.update(range(start, end + 1, int(step or 1)))
+    return values
+
+def parse_cron(expression):
+    fields = expression.split()
+    if len(fields) != len(cron_fields): raise ValueError(f'Cron needs 5 fields: {expression}')
+    cron = {name: parse_cron_field(field, low, high) for field, (name, low, high) in zip(fields, cron_fields)}
+    # Sunday may be written as 0 or 7, as in most crontabs.
+    cron['weekday'] = {day % 7 for day in cron['weekday']}
+    cron['any_day'] = fields[2].startswith('*')
+    cron['any_weekday'] = fields[4].startswith('*')
+    return cron
+
+def cron_matches(cron, when):
+    if not (when.minute in cron['minute'] and when.hour in cron['hour'] and when.month in cron['month']):
+        return False
+    day = when.day in cron['day']
+    weekday = (when.weekday() + 1) % 7 in cron['weekday']
+    # As in cron, a day of the month and a weekday both given match either one.
+    if cron['any_day'] or cron['any_weekday']: return day and weekday
+    return day or weekday
+
+def validate_step(step):
+    kinds = [kind for kind in ('action', 'wait', 'request') if kind in step]
+    if len(kinds) != 1: raise ValueError(f'Step needs exactly one of action, wait or request: {step}')
+    if 'action' in step and step['action'] not in fleet_actions:
+        raise ValueError(f'Unknown action: {step["action"]}')
+    if 'action' in step: parse_value(step['action'], step.get('value'))
+    if 'wait' in step and step['wait'] not in wait_gates:
+        raise ValueError(f'Unknown wait gate: {step["wait"]}')
+    if 'request' in step and not {'service', 'method'} <= set(step['request']):
+        raise ValueError(f'Request step needs a service and method: {step}')
+
+def load_macros(path=base_path/macros_filename):
+    with open(path) as file:
+        if str(path).endswith(('.yaml', '.yml')):
+            import yaml
+            config = yaml.safe_load(file)
+        else:
+            config = json.load(file)
+    config.setdefault('macros', {})
+    config.setdefault('groups', {})
+    config.setdefault('schedule', [])
+    for name, macro in config['macros'].items():
+        if not macro.get('steps'): raise ValueError(f'Macro has no steps: {name}')
+        for step in macro['steps']: validate_step(step)
+    for entry in config['schedule']:
+        if entry['macro'] not in config['macros']: raise ValueError(f'Unknown macro: {entry["macro"]}')
+        entry['cron_fields'] = parse_cron(entry['cron'])
+    return config
+
+def run_step(client, step, id=1):
+    if 'action' in step:
+        action = step['action']
+        return fleet_actions[action](client, parse_value(action, step.get('value')), id)
+    if 'wait' in step:
+        getter, predicate = wait_gates[step['wait']](client, step.get('value'))
+        confirmed, _ = confirm(getter, predicate, deadline=float(step.get('timeout', gate_timeout)))
+        if not confirmed: raise RuntimeError(f'Timed out waiting for {step["wait"]}')
+        return 'Ready'
+    request = step['request']
+    api_request = RESTRequest(request['service'], request['method'], params=request.get('params'), id=id,
+                              ver=request.get('version'))
+    return get_result(client.send_request(api_request))
+
+def get_dry_run_client(tv, steps):
+    from bcmock import MockTV, MockClient
+    # A mock preloaded with the inputs and apps the macro names, so a dry run checks the sequence, not the TV.
+    # It starts in standby when the macro powers the TV on itself, and awake otherwise.
+    power = not any(step.get('action') == 'power' for step in steps)
+    input_titles = [str(step['value']) for step in steps if step.get('action') == 'input']
+    app_titles = [str(step['value']) for step in steps if step.get('action') == 'launch']
+    mock = MockTV(str(tv['ip']), model=tv.get('modelName') or 'Mock', power=power, input_titles=input_titles,
+                  app_titles=app_titles)
+    return MockClient(mock, psk=tv['psk'])
+
+def run_macro_on_tv(tv, steps, id=1, dry_run=False):
+    client = get_dry_run_client(tv, steps) if dry_run else get_client(tv['ip'], psk=tv['psk'])
+    start = perf_counter()
+    results = []
+    for i, step in enumerate(steps):
+        step_start = perf_counter()
+        result = {'step': i, 'kind': next(kind for kind in ('action', 'wait', 'request') if kind in step)}
+        try:
+            result['detail'] = run_step(client, step, id=id)
+            result['ok'] = True
+        except Exception as e:
+            result['error'] = str(e) or type(e).__name__
+            result['ok'] = False
+        result['latency'] = round(perf_counter() - step_start, 3)
+        results.append(result)
+        if not result['ok']: break
+    return {
+        'ip': str(tv['ip']),
+        'model': tv.get('modelName'),
+        'ok': all(result['ok'] for result in results),
+        'latency': round(perf_counter() - start, 3),
+        'steps': results
+    }
+
+class MacroEngine:
+    def __init__(self, tvs, path=base_path/macros_filename, history_path=base_path/history_filename):
+        self.tvs = tvs
+        self.path = path
+        self.history_path = history_path
+        self.config = load_macros(path)
+        self.history = deque(maxlen=history_size)
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=4)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.load_history()
+
+    @property
+    def macros(self):
+        return self.config['macros']
+
+    def load_history(self):
+        try:
+            with open(self.history_path) as file:
+                lines = deque(file, maxlen=history_size)
+        except OSError:
+            return
+        for line in lines:
+            try: self.history.append(json.loads(line))
+            except ValueError: pass
+
+    def record(self, run):
+        with self.lock:
+            self.history.append(run)
+            with open(self.history_path, 'a') as file:
+                file.write(json.dumps(run, default=str) + '\n')
+
+    def get_targets(self, group=None, ips=None):
+        if ips is None:
+            if group in (None, 'all'): return list(self.tvs)
+            if group not in self.config['groups']: raise ValueError(f'Unknown group: {group}')
+            ips = self.config['groups'][group]
+        known = {tv['ip']: tv for tv in self.tvs}
+        targets = []
+        for ip in ips:
+            ip = ip_address(ip)
+            targets.append(known.get(ip) or {'ip': ip, 'psk': credentials.resolve({'ip': ip})})
+        return targets
+
+    def run(self, name, group=None, ips=None, dry_run=False, id=1, trigger='manual'):
+        if name not in self.macros: raise ValueError(f'Unknown macro: {name}')
+        steps = self.macros[name]['steps']
+        tvs = self.get_targets(group, ips)
+        started = time.time()
+        results = []
+        if tvs:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(tvs))) as pool:
+                results = list(pool.map(lambda tv: run_macro_on_tv(tv, steps, id=id, dry_run=dry_run), tvs))
+        run = {
+            'macro': name,
+            'group': group,
+            'trigger': trigger,
+            'dry_run': dry_run,
+            'started': started,
+            'finished': time.time(),
+            'ok': all(result['ok'] for result in results),
+            'results': results
+        }
+        self.record(run)
+        return run
+
+    def run_scheduler(self):
+        when = datetime.now().replace(second=0, microsecond=0)
+        while not self.stopped.is_set():
+            when += timedelta(minutes=1)
+            # Wait for each minute boundary rather than sleeping a fixed time, so runs never drift or skip.
+            while (delay := (when - datetime.now()).total_seconds()) > 0:
+                if self.stopped.wait(delay): return
+            for entry in self.config['schedule']:
+                if cron_matches(entry['cron_fields'], when):
+                    self.pool.submit(self.run, entry['macro'], group=entry.get('group'),
+                                     dry_run=entry.get('dry_run', False), trigger='schedule')
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive(): return self.thread
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run_scheduler, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self.stopped.set()
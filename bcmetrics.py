@@ -0,0 +1,210 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+metrics_port = 9100
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+current_span = ContextVar('current_span', default=None)
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{{{format_labels(self.labels, key)}}} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=latency_buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def quantile(self, q, key):
+        # Interpolated within the bucket, the same estimate Prometheus' histogram_quantile() gives.
+        with self.lock:
+            counts, _ = self.values[key]
+            counts = list(counts)
+        rank = q * sum(counts)
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets): return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return None
+
+    def summary(self):
+        with self.lock:
+            keys = sorted(self.values)
+        rows = []
+        for key in keys:
+            counts, total = self.values[key]
+            count = sum(counts)
+            rows.append({**dict(zip(self.labels, key)), 'count': count, 'mean': round(total / count, 4),
+                         'p50': round(self.quantile(0.5, key), 4), 'p99': round(self.quantile(0.99, key), 4)})
+        return rows
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            items = sorted((key, list(counts), total) for key, (counts, total) in self.values.items())
+        for key, counts, total in items:
+            labels = format_labels(self.labels, key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+def format_labels(labels, key):
+    escape = lambda value: value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{label}="{escape(value)}"' for label, value in zip(labels, key))
+
+request_labels = ['ip', 'service', 'method']
+requests_total = Counter('bravia_requests_total', 'REST API calls by TV, method and HTTP status.',
+                         request_labels + ['status'])
+request_bytes = Counter('bravia_response_bytes_total', 'Response body bytes received from TVs.', request_labels)
+request_seconds = Histogram('bravia_request_seconds', 'REST API call latency including retries.', request_labels)
+handler_seconds = Histogram('bravia_handler_seconds', 'Interface callback latency.', ['handler', 'outcome'])
+metrics = [requests_total, request_bytes, request_seconds, handler_seconds]
+
+trace_file = None
+trace_lock = threading.Lock()
+
+def set_trace_log(path):
+    global trace_file
+    trace_file = open(path, 'a', buffering=1) if path else None
+
+def trace(event, **fields):
+    if trace_file is None: return
+    line = json.dumps({'time': time.time(), 'event': event, 'span': current_span.get(), **fields}, default=str)
+    with trace_lock:
+        trace_file.write(line + '\n')
+
+@contextmanager
+def timed_request(ip, api_request):
+    call = {'status': 'error', 'bytes': 0}
+    start = time.perf_counter()
+    try:
+        yield call
+    finally:
+        latency = time.perf_counter() - start
+        labels = {'ip': str(ip), 'service': api_request.service, 'method': api_request.method}
+        requests_total.inc(status=call['status'], **labels)
+        request_bytes.inc(call['bytes'], **labels)
+        request_seconds.observe(latency, **labels)
+        trace('request', id=api_request.id, status=call['status'], bytes=call['bytes'],
+              latency=round(latency, 6), **labels)
+
+def traced(handler):
+    name = handler.__name__
+
+    def record(start, outcome):
+        latency = time.perf_counter() - start
+        handler_seconds.observe(latency, handler=name, outcome=outcome)
+        trace('handler', handler=name, outcome=outcome, latency=round(latency, 6))
+
+    # Gradio reads the signature and checks for coroutines and generators, so the wrapper keeps all three.
+    if inspect.isasyncgenfunction(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            # No span here, as each step of a generator may run in a different context.
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                async for result in handler(*args, **kwargs):
+                    yield result
+                outcome = 'ok'
+            finally:
+                record(start, outcome)
+    elif inspect.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            token = current_span.set(os.urandom(8).hex())
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = await handler(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                record(start, outcome)
+                current_span.reset(token)
+    else:
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            token = current_span.set(os.urandom(8).hex())
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                result = handler(*args, **kwargs)
+                outcome = 'ok'
+                return result
+            finally:
+                record(start, outcome)
+                current_span.reset(token)
+    return wrapper
+
+def render_metrics():
+    return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+def get_latency_summary():
+    return {'requests': request_seconds.summary(), 'handlers': handler_seconds.summary()}
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            body, content_type = render_metrics().encode(), 'text/plain; version=0.0.4; charset=utf-8'
+        elif path == '/latency':
+            body, content_type = json.dumps(get_latency_summary(), indent=1).encode(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve_metrics(port=metrics_port, host='0.0.0.0'):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
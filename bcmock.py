@@ -0,0 +1,348 @@
+import functools
+import json
+import random
+import socket
+import struct
+import threading
+import time
+import zlib
+from argparse import ArgumentParser
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from ipaddress import ip_address
+from bcbackend import RESTResponse, prepare_batch
+
+mock_port = 8080
+mock_ssdp_port = 1900
+mock_wol_port = 8009
+ssdp_group = '239.255.255.250'
+ssdp_usn = 'urn:schemas-sony-com:service:ScalarWebAPI:1'
+open_methods = {'getInterfaceInformation', 'getPowerStatus', 'getSupportedApiInfo', 'getRemoteControllerInfo'}
+remote_codes = {name: f'AAAAAQAAAAEAAA{i:03d}Aw==' for i, name in enumerate([
+    'PowerOff', 'Input', 'Home', 'Return', 'Options', 'ActionMenu', 'Up', 'Down', 'Left', 'Right', 'Confirm',
+    'VolumeUp', 'VolumeDown', 'Mute', 'ChannelUp', 'ChannelDown', 'Play', 'Pause', 'Rewind', 'Forward'])}
+icon_size = 256
+
+@functools.cache
+def make_icon(seed, size=icon_size):
+    # A valid RGBA PNG with a gradient per seed, so icons differ in content and decode like real ones.
+    chunk = lambda kind, data: (struct.pack('>I', len(data)) + kind + data
+                                + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    rows = b''.join(b'\x00' + b''.join(bytes((x * 255 // size, y * 255 // size, seed * 37 % 256, 255))
+                                      for x in range(size)) for y in range(size))
+    header = struct.pack('>IIBBBBB', size, size, 8, 6, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b'')
+
+class MockTV:
+    def __init__(self, ip='127.0.0.1', port=mock_port, psk=None, latency=0.0, error_rate=0.0,
+                 model='KD-55X85J', app_count=20, mac=None, serial=None, seed=None, power=True, input_titles=(),
+                 app_titles=(), wol_port=None, wake_delay=1.0):
+        self.ip = ip
+        self.port = port
+        self.psk = psk
+        self.latency = latency
+        self.error_rate = error_rate
+        self.model = model
+        self.mac = mac or '02:00:00:%02x:%02x:%02x' % tuple(ip_address(ip).packed[-3:])
+        self.serial = serial or '%07d' % (int(self.mac.replace(':', ''), 16) % 10 ** 7)
+        self.wol_port = wol_port
+        self.wake_delay = wake_delay
+        self.asleep = False
+        self.wol_sock = None
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self.keys = []
+        self.lock = threading.Lock()
+        self.power = power
+        self.volume = 10
+        self.mute = False
+        self.uri = 'extInput:hdmi?port=1'
+        self.inputs = [{'uri': f'extInput:hdmi?port={i}', 'title': f'HDMI {i}', 'label': '', 'icon': '',
+                        'connection': True, 'status': 'true'} for i in range(1, 5)]
+        self.inputs += [{'uri': f'extInput:hdmi?port={i}', 'title': title, 'label': '', 'icon': '',
+                         'connection': True, 'status': 'true'} for i, title in enumerate(input_titles, 5)]
+        app_titles = [f'App {i:02d}' for i in range(app_count)] + list(app_titles)
+        self.apps = [{'title': title, 'uri': f'com.sony.dtv.app{i}', 'icon': f'http://{ip}:{port}/icons/{i}.png'}
+                     for i, title in enumerate(app_titles)]
+        self.methods = {
+            'system': {
+                'getInterfaceInformation': self.get_interface_information,
+                'getPowerStatus': lambda params: [{'status': 'active' if self.power else 'standby'}],
+                'setPowerStatus': self.set_power_status,
+                'getNetworkSettings': lambda params: [[{'netif': 'eth0', 'hwAddr': self.mac, 'ipAddrV4': self.ip}]],
+                'getSystemInformation': lambda params: [{'product': 'TV', 'model': self.model, 'serial': self.serial,
+                                                         'macAddr': self.mac, 'name': 'BRAVIA'}],
+                'getRemoteControllerInfo': lambda params: [{'bundled': True, 'type': 'IR_REMOTE_BUNDLE_TYPE_AEP_N'},
+                                                           [{'name': name, 'value': code}
+                                                            for name, code in remote_codes.items()]]
+            },
+            'avContent': {
+                'getCurrentExternalInputsStatus': lambda params: [self.inputs],
+                'getPlayingContentInfo': lambda params: [{'uri': self.uri, 'source': 'extInput:hdmi'}],
+                'setPlayContent': self.set_play_content
+            },
+            'audio': {
+                'getVolumeInformation': lambda params: [[{'target': 'speaker', 'volume': self.volume,
+                                                          'mute': self.mute, 'maxVolume': 100, 'minVolume': 0}]],
+                'setAudioVolume': self.set_audio_volume,
+                'setAudioMute': self.set_audio_mute
+            },
+            'appControl': {
+                'getApplicationList': lambda params: [self.apps],
+                'setActiveApp': lambda params: [],
+                'terminateApps': lambda params: []
+            },
+            'guide': {
+                'getSupportedApiInfo': self.get_supported_api_info
+            }
+        }
+        self.server = None
+        self.thread = None
+
+    def handler(self):
+        tv = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body, content_type='application/json', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def drop(self):
+                # In deep standby the TV does not answer at all.
+                self.close_connection = True
+
+            def do_GET(self):
+                if tv.asleep: return self.drop()
+                tv.count('GET ' + self.path.split('/')[1])
+                if not self.path.startswith('/icons/'):
+                    return self.reply(404, b'', 'text/plain')
+                etag = f'"{tv.model}-{self.path}"'
+                if self.headers.get('If-None-Match') == etag:
+                    return self.reply(304, b'', 'image/png', {'ETag': etag})
+                seed = int(''.join(filter(str.isdigit, self.path)) or 0)
+                self.reply(200, make_icon(seed), 'image/png', {'ETag': etag})
+
+            def do_POST(self):
+                service = self.path.rstrip('/').split('/')[-1]
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if tv.asleep: return self.drop()
+                if service == 'IRCC':
+                    status = tv.press(body.decode(), self.headers.get('X-Auth-PSK'))
+                    return self.reply(status, b'', 'text/xml')
+                request = json.loads(body)
+                status, data = tv.call(service, request, self.headers.get('X-Auth-PSK'))
+                self.reply(status, json.dumps(data).encode())
+
+        return Handler
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def call(self, service, request, psk):
+        method = request.get('method')
+        params = (request.get('params') or [{}])[0]
+        self.count(method)
+        latency = self.latency.get(method, 0.0) if isinstance(self.latency, dict) else self.latency
+        if latency: time.sleep(latency)
+        reply = {'id': request.get('id')}
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 500, {**reply, 'error': [500, 'Mock Error']}
+        if self.psk is not None and method not in open_methods and psk != self.psk:
+            return 403, {**reply, 'error': [403, 'Forbidden']}
+        handler = self.methods.get(service, {}).get(method)
+        if handler is None:
+            return 200, {**reply, 'error': [12, 'No Such Method']}
+        if service in ('avContent', 'audio') and not self.power:
+            return 200, {**reply, 'error': [40005, 'Display Is Turned off']}
+        with self.lock:
+            return 200, {**reply, 'result': handler(params)}
+
+    def press(self, envelope, psk):
+        code = envelope.partition('<IRCCCode>')[2].partition('</IRCCCode>')[0]
+        key = next((name for name, value in remote_codes.items() if value == code), None)
+        self.count('IRCC')
+        latency = self.latency.get('IRCC', 0.0) if isinstance(self.latency, dict) else self.latency
+        if latency: time.sleep(latency)
+        if self.psk is not None and psk != self.psk: return 403
+        if key is None: return 500
+        with self.lock:
+            self.keys.append(key)
+        return 200
+
+    def get_interface_information(self, params):
+        return [{'productCategory': 'tv', 'productName': 'BRAVIA', 'modelName': self.model, 'serverName': '',
+                 'interfaceVersion': '6.0.0'}]
+
+    def get_supported_api_info(self, params):
+        return [[{'service': service, 'protocols': ['xhrpost:jsonizer'],
+                  'apis': [{'name': name, 'versions': [{'version': '1.0'}]} for name in methods]}
+                 for service, methods in self.methods.items() if service != 'guide']]
+
+    def set_power_status(self, params):
+        self.power = bool(params.get('status'))
+        return []
+
+    def set_play_content(self, params):
+        self.uri = params['uri']
+        return []
+
+    def set_audio_volume(self, params):
+        volume = params['volume']
+        self.volume = self.volume + int(volume) if volume[0] in '+-' else int(volume)
+        return []
+
+    def set_audio_mute(self, params):
+        self.mute = bool(params['status'])
+        return []
+
+    def deep_standby(self):
+        self.power = False
+        self.asleep = True
+
+    def listen_wol(self):
+        magic = b'\xff' * 6 + bytes.fromhex(self.mac.replace(':', '')) * 16
+        while True:
+            try: payload = self.wol_sock.recv(1024)
+            except OSError: return
+            if payload == magic and self.asleep:
+                self.count('WOL')
+                threading.Timer(self.wake_delay, setattr, (self, 'asleep', False)).start()
+
+    def start(self):
+        self.server = ThreadingHTTPServer((self.ip, self.port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        if self.wol_port:
+            self.wol_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.wol_sock.bind((self.ip, self.wol_port))
+            threading.Thread(target=self.listen_wol, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.wol_sock: self.wol_sock.close()
+
+class MockClient:
+    # Drop-in for RESTClient that calls a MockTV in-process, for dry runs that must not touch the network.
+    def __init__(self, tv, psk=None):
+        self.tv = tv
+        self.ip = ip_address(tv.ip)
+        self.psk = str(psk if psk is not None else tv.psk)
+
+    def send_request(self, api_request, timeout=None):
+        request = {'method': api_request.method, 'id': api_request.id, 'version': api_request.ver or '1.0',
+                   'params': api_request.params if isinstance(api_request.params, list) else [api_request.params]}
+        status, data = self.tv.call(api_request.service, request, self.psk)
+        return RESTResponse(status_code=status, headers={'Content-Type': 'application/json'}, data=data)
+
+    def send_batch(self, api_requests, id=1):
+        batch = prepare_batch(api_requests, id=id)
+        return [self.send_request(api_request) for api_request in batch]
+
+    def with_psk(self, psk):
+        return MockClient(self.tv, psk=psk)
+
+    def get_wake_mac(self):
+        return self.tv.mac
+
+    def wake(self, mac):
+        # No packet is sent: the real TV at this address must stay as it is.
+        if self.tv.asleep: self.tv.count('WOL')
+        self.tv.asleep = False
+
+    def learn_wake_mac(self):
+        pass
+
+    def close(self):
+        pass
+
+class MockSSDPResponder:
+    def __init__(self, tvs, port=mock_ssdp_port, address='127.0.0.1'):
+        self.tvs = tvs
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', port))
+        membership = struct.pack('4s4s', socket.inet_aton(ssdp_group), socket.inet_aton(address))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self.sock.settimeout(0.2)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def serve(self):
+        while not self.stopped.is_set():
+            try: data, sender = self.sock.recvfrom(1024)
+            except socket.timeout: continue
+            if not data.startswith(b'M-SEARCH'): continue
+            for tv in self.tvs:
+                response = (f'HTTP/1.1 200 OK\r\nCACHE-CONTROL: max-age=1800\r\nEXT:\r\n'
+                            f'LOCATION: http://{tv.ip}:{tv.port}/sony/\r\nST: {ssdp_usn}\r\n'
+                            f'USN: uuid:mock-{tv.ip}::{ssdp_usn}\r\n\r\n')
+                self.sock.sendto(response.encode(), sender)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread: self.thread.join()
+        self.sock.close()
+
+class MockFleet:
+    # TVs share one port on consecutive loopback addresses (127.0.0.2, 127.0.0.3, ...), which Linux routes
+    # without any setup.
+    def __init__(self, count=1, port=mock_port, ssdp_port=mock_ssdp_port, ssdp=True, **kwargs):
+        self.tvs = [MockTV(f'127.0.0.{2 + i}', port=port, **kwargs) for i in range(count)]
+        self.responder = MockSSDPResponder(self.tvs, port=ssdp_port) if ssdp else None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        for tv in self.tvs: tv.start()
+        if self.responder: self.responder.start()
+        return self
+
+    def stop(self):
+        for tv in self.tvs: tv.stop()
+        if self.responder: self.responder.stop()
+
+    @property
+    def counts(self):
+        return sum((tv.counts for tv in self.tvs), Counter())
+
+    def reset_counts(self):
+        for tv in self.tvs: tv.counts.clear()
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Mock BRAVIA REST API server')
+    parser.add_argument('--tvs', type=int, default=1, help='number of simulated TVs')
+    parser.add_argument('--port', type=int, default=mock_port)
+    parser.add_argument('--psk', default=None)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every call')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls that fail')
+    args = parser.parse_args()
+    fleet = MockFleet(args.tvs, port=args.port, psk=args.psk, latency=args.latency, error_rate=args.error_rate)
+    fleet.start()
+    print('Serving mock TVs:', ', '.join(f'{tv.ip}:{tv.port}' for tv in fleet.tvs))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fleet.stop()
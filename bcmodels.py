@@ -0,0 +1,65 @@
+import html
+from dataclasses import dataclass
+
+# Parsed once per response. Slots keep them small and fast to read, since the interface walks them on every render.
+
+@dataclass(slots=True)
+class PowerState:
+    status: str
+
+    @property
+    def active(self):
+        return self.status == 'active'
+
+    @classmethod
+    def parse(cls, item):
+        return cls(item['status'])
+
+@dataclass(slots=True)
+class InputInfo:
+    index: int
+    uri: str
+    title: str
+    label: str
+    icon: str = ''
+    connection: bool = False
+    status: str = ''
+
+    @classmethod
+    def parse(cls, index, item):
+        uri = item['uri']
+        title = item.get('title', '')
+        if uri.startswith('extInput:cec?'): title += ' (CEC)'
+        return cls(index, uri, title, item.get('label') or 'No Label', item.get('icon', ''),
+                   item.get('connection', False), item.get('status', ''))
+
+@dataclass(slots=True)
+class AppInfo:
+    index: int
+    uri: str
+    title: str
+    icon: str = ''
+    thumbnail: str | None = None
+    cached_icon_path: str | None = None
+
+    @classmethod
+    def parse(cls, index, item):
+        return cls(index, item['uri'], html.unescape(item.get('title', '')), item.get('icon', ''))
+
+@dataclass(slots=True)
+class VolumeInfo:
+    target: str
+    volume: int
+    mute: bool
+    min_volume: int = 0
+    max_volume: int = 100
+
+    @classmethod
+    def parse(cls, item):
+        return cls(item['target'], item['volume'], item['mute'], item.get('minVolume', 0), item.get('maxVolume', 100))
+
+def index_by_uri(items):
+    # The first of any duplicate URIs wins, as a front-to-back search would find it.
+    index = {}
+    for item in items: index.setdefault(item.uri, item)
+    return index
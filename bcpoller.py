@@ -0,0 +1,96 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bcbackend import TVState, get_client
+
+poll_interval = 5.0
+poll_jitter = 0.2
+standby_interval = 30.0
+max_backoff = 120.0
+status_ttl = 20.0
+max_workers = 16
+power_methods = [('system', 'getPowerStatus')]
+active_methods = [
+    ('avContent', 'getCurrentExternalInputsStatus'),
+    ('avContent', 'getPlayingContentInfo'),
+    ('audio', 'getVolumeInformation')
+]
+
+class StatusPoller:
+    def __init__(self, tvs, interval=poll_interval, jitter=poll_jitter, standby_interval=standby_interval,
+                 max_backoff=max_backoff, ttl=status_ttl, max_workers=max_workers):
+        self.tvs = tvs
+        self.interval = interval
+        self.jitter = jitter
+        self.standby_interval = standby_interval
+        self.max_backoff = max_backoff
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.cache = {}
+        self.due = {}
+        self.failures = {}
+        self.polling = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def get(self, ip):
+        entry = self.cache.get(ip)
+        if entry is None or time.monotonic() - entry['updated'] > self.ttl:
+            return None
+        return entry
+
+    def schedule(self, ip, delay):
+        # Jitter spreads polls out so a large fleet is not hit in lockstep.
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        with self.lock:
+            self.due[ip] = time.monotonic() + delay
+            self.polling.discard(ip)
+
+    def poll(self, tv):
+        ip = tv['ip']
+        client = get_client(ip, psk=tv['psk'])
+        try:
+            state = TVState.fetch(client, methods=power_methods)
+            if state.result('getPowerStatus') is None: raise RuntimeError('No power status')
+            power_status = state.power_status
+            if power_status: state.update(client, methods=active_methods)
+        except:
+            failures = self.failures.get(ip, 0) + 1
+            self.failures[ip] = failures
+            self.cache[ip] = {'online': False, 'power': None, 'input': None, 'volume': None,
+                              'updated': time.monotonic()}
+            self.schedule(ip, min(self.interval * 2 ** failures, self.max_backoff))
+            return
+        self.failures.pop(ip, None)
+        self.cache[ip] = {
+            'online': True,
+            'power': power_status,
+            'input': state.input if power_status else None,
+            'volume': state.volume if power_status else None,
+            'updated': time.monotonic()
+        }
+        self.schedule(ip, self.interval if power_status else self.standby_interval)
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while not self.stopped.is_set():
+                now = time.monotonic()
+                for tv in list(self.tvs):
+                    ip = tv['ip']
+                    with self.lock:
+                        if ip in self.polling or self.due.get(ip, 0) > now: continue
+                        self.polling.add(ip)
+                    pool.submit(self.poll, tv)
+                self.stopped.wait(0.5)
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive(): return self.thread
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,19 @@
+import bcbackend
+from bcbackend import get_tvs
+
+def clear_capabilities():
+    bcbackend.tv_capabilities.clear()
+
+def bench_get_tvs_listed(benchmark, fleet, tv_list):
+    fleet.reset_counts()
+    tvs = benchmark.pedantic(get_tvs, args=(tv_list,), setup=clear_capabilities, rounds=10)
+    assert len(tvs) == len(fleet.tvs)
+    benchmark.extra_info['tvs'] = len(fleet.tvs)
+    benchmark.extra_info['requests_per_round'] = sum(fleet.counts.values()) / 10
+
+def bench_get_tvs_ssdp(benchmark, fleet, monkeypatch):
+    # Dominated by the SSDP listen window, so it is shortened to keep the suite quick.
+    monkeypatch.setattr(bcbackend, 'ssdp_timeout', 1)
+    tvs = benchmark.pedantic(get_tvs, setup=clear_capabilities, rounds=3)
+    assert len(tvs) == len(fleet.tvs)
+    benchmark.extra_info['tvs'] = len(fleet.tvs)
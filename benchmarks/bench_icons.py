@@ -0,0 +1,29 @@
+import bcbackend
+from bcbackend import RESTRequest, get_apps, get_client
+from bcicons import IconCache
+
+def get_app_list_response(tv):
+    client = get_client(tv['ip'], psk=tv['psk'])
+    return client, client.send_request(RESTRequest('appControl', 'getApplicationList'))
+
+def bench_get_apps_cold(benchmark, fleet, tv_list, tmp_path, monkeypatch):
+    client, response = get_app_list_response(tv_list[0])
+    caches = iter(range(1000))
+
+    def setup():
+        path = tmp_path/str(next(caches))
+        path.mkdir()
+        monkeypatch.setattr(bcbackend, 'icon_cache', IconCache(path))
+        return (client,), {'response': response}
+
+    apps = benchmark.pedantic(get_apps, setup=setup, rounds=10)
+    assert all(app.cached_icon_path.startswith(str(tmp_path)) for app in apps)
+    benchmark.extra_info['icons'] = len(apps)
+
+def bench_get_apps_warm(benchmark, fleet, tv_list):
+    client, response = get_app_list_response(tv_list[0])
+    get_apps(client, response=response)
+    fleet.tvs[0].counts.clear()
+    apps = benchmark(get_apps, client, response=response)
+    assert fleet.tvs[0].counts['GET icons'] == 0
+    benchmark.extra_info['icons'] = len(apps)
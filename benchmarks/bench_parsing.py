@@ -0,0 +1,34 @@
+import copy
+import pytest
+from bcbackend import RESTResponse, TVState, get_cached_apps, invalidate_apps, state_methods
+from bcmock import MockTV
+
+@pytest.fixture(scope='module')
+def responses():
+    # Parsing only, no network: replies come straight from a mock with a large input and app list.
+    tv = MockTV('127.0.0.1', psk='0000', app_count=200, input_titles=[f'Input {i}' for i in range(12)])
+    responses = {}
+    for service, method in state_methods:
+        status, data = tv.call(service, {'method': method, 'params': [{}], 'id': 1}, '0000')
+        responses[method] = RESTResponse(status, {'Content-Type': 'application/json; charset=UTF-8'}, data)
+    return responses
+
+def bench_render_state(benchmark, responses):
+    # What one refresh reads: the input list, the current input three times and the volume targets.
+    def render():
+        state = TVState(copy.copy(responses))
+        for _ in range(3):
+            inputs = state.inputs
+            input = state.input
+            volume = state.volume
+        return inputs, input, volume
+
+    inputs, input, volume = benchmark(render)
+    assert len(inputs) == 16 and input.uri == 'extInput:hdmi?port=1' and volume[0].target == 'speaker'
+
+def bench_cached_apps_unchanged(benchmark, responses):
+    response = responses['getApplicationList']
+    invalidate_apps('bench')
+    get_cached_apps('bench', response)
+    _, apps, apps_by_uri = benchmark(get_cached_apps, 'bench', response)
+    assert len(apps) == 200 and apps_by_uri[apps[0].uri] is apps[0]
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import shutil
+import pytest
+import bcbackend
+import bcfrontend
+import bcicons
+from bcicons import IconCache
+from bcasync import get_async_client
+from bcbackend import get_tvs
+from bcfrontend import FrontendGUI, Session
+
+@pytest.fixture(scope='module')
+def loop():
+    # One loop for every round, as under Gradio, so pooled connections are reused.
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+@pytest.fixture(scope='module')
+def tvs(fleet, tv_list):
+    return get_tvs(tv_list)
+
+@pytest.fixture
+def session(tvs):
+    session = Session()
+    session.tvs_index = 0
+    session.tv = tvs[0]
+    session.psk = session.tv['psk']
+    session.client = get_async_client(session.tv['ip']).with_psk(session.psk)
+    return session
+
+def bench_refresh_interface(benchmark, fleet, tvs, session, loop):
+    gui = FrontendGUI(tvs)
+    refresh = lambda: loop.run_until_complete(gui.refresh_interface(session))
+    refresh()
+    tv = next(tv for tv in fleet.tvs if tv.ip == str(session.tv['ip']))
+    tv.counts.clear()
+    benchmark.pedantic(refresh, rounds=20)
+    assert session.auth_status and session.power_status
+    requests = sum(count for method, count in tv.counts.items() if not method.startswith('GET'))
+    benchmark.extra_info['requests_per_refresh'] = requests / 20
+
+def bench_gallery_first_paint(benchmark, fleet, tvs, session, loop, tmp_path, monkeypatch):
+    # Cold start: no app list or icons cached. First paint is the refresh; icons then stream in.
+    gui = FrontendGUI(tvs)
+    caches = iter(range(1000))
+
+    def setup():
+        path = tmp_path/str(next(caches))
+        path.mkdir()
+        shutil.copy(bcicons.cache_path/bcicons.placeholder_filename, path)
+        monkeypatch.setattr(bcfrontend, 'icon_cache', IconCache(path))
+        bcbackend.invalidate_apps(session.tv['ip'])
+        session.gallery_key = None
+
+    outputs = benchmark.pedantic(lambda: loop.run_until_complete(gui.refresh_interface(session)), setup=setup,
+                                 rounds=10)
+    assert outputs[13].value
+
+    async def stream():
+        async for gallery in gui.set_app_gallery_stream(None): pass
+        return gallery
+
+    monkeypatch.setattr(gui.sessions, 'get', lambda request: session)
+    gallery = loop.run_until_complete(stream())
+    paths = [item['image']['path'] for item in gallery.value]
+    benchmark.extra_info['gallery_bytes'] = sum(os.path.getsize(path) for path in paths)
@@ -0,0 +1,42 @@
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from conftest import fleet_port
+
+repo_path = Path(__file__).resolve().parent.parent
+gui_modules = ('gradio', 'aiohttp', 'ssdpy', 'tqdm')
+
+@pytest.fixture(scope='module')
+def cli_path(tmp_path_factory):
+    # The modules keep their state files beside them, so the commands run from a copy to keep those out of the repo.
+    path = tmp_path_factory.mktemp('cli')
+    for module in repo_path.glob('*.py'): shutil.copy(module, path)
+    (path/'iconcache').mkdir()
+    shutil.copy(repo_path/'iconcache'/'placeholder.png', path/'iconcache')
+    return path
+
+def run_bc(cli_path, *args, importtime=False):
+    options = ['-X', 'importtime'] if importtime else []
+    return subprocess.run([sys.executable, *options, '-m', 'bc', *args], cwd=cli_path, capture_output=True,
+                          text=True)
+
+def bench_cli_help(benchmark, cli_path):
+    result = benchmark.pedantic(run_bc, args=(cli_path, '--help'), rounds=5)
+    assert result.returncode == 0
+
+def bench_cli_command(benchmark, fleet, cli_path):
+    tv = fleet.tvs[0]
+    args = ('--rest-port', str(fleet_port), 'power', 'on', '--ip', tv.ip, '--psk', tv.psk)
+    result = benchmark.pedantic(run_bc, args=(cli_path, *args), rounds=5)
+    assert result.returncode == 0, result.stdout + result.stderr
+    # One-shot commands must not load the interface or discovery stacks.
+    imported = run_bc(cli_path, *args, importtime=True).stderr
+    assert not [module for module in gui_modules if f' {module}\n' in imported]
+
+def bench_gui_import(benchmark, cli_path):
+    # The cost the CLI avoids, for comparison.
+    command = [sys.executable, '-c', 'import bcfrontend']
+    result = benchmark.pedantic(subprocess.run, args=(command,), kwargs={'cwd': cli_path}, rounds=3)
+    assert result.returncode == 0
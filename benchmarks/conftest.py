@@ -0,0 +1,47 @@
+import shutil
+import sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bcbackend
+import bccredentials
+import bcdiscovery
+import bcicons
+import bcfrontend
+from ipaddress import ip_address
+from bcmock import MockFleet
+
+fleet_size = 16
+fleet_port = 8080
+fleet_ssdp_port = 1900
+fleet_latency = 0.005
+
+@pytest.fixture(scope='session')
+def fleet(tmp_path_factory):
+    patch = pytest.MonkeyPatch()
+    # Point the clients and the SSDP search at the loopback mocks, and keep the capability cache and the
+    # credential store out of the repo.
+    patch.setattr(bcbackend, 'rest_port', fleet_port)
+    patch.setattr(bcbackend, 'ssdp_port', fleet_ssdp_port)
+    patch.setattr(bcbackend, 'ssdp_address', '127.0.0.1')
+    patch.setattr(bcbackend, 'base_path', tmp_path_factory.mktemp('state'))
+    icon_path = tmp_path_factory.mktemp('iconcache')
+    shutil.copy(bcicons.cache_path/bcicons.placeholder_filename, icon_path)
+    icon_cache = bcicons.IconCache(icon_path)
+    patch.setattr(bcbackend, 'icon_cache', icon_cache)
+    patch.setattr(bcfrontend, 'icon_cache', icon_cache)
+    state_path = tmp_path_factory.mktemp('credentials')
+    credentials = bccredentials.CredentialStore(state_path/bccredentials.credentials_filename,
+                                                state_path/bccredentials.key_filename)
+    for module in (bcbackend, bcdiscovery, bcfrontend):
+        patch.setattr(module, 'credentials', credentials)
+    with MockFleet(fleet_size, port=fleet_port, ssdp_port=fleet_ssdp_port, latency=fleet_latency,
+                   psk='0000', seed=0) as fleet:
+        yield fleet
+    patch.undo()
+
+@pytest.fixture(scope='session')
+def tv_list(fleet):
+    return [{'ip': ip_address(tv.ip), 'psk': tv.psk} for tv in fleet.tvs]
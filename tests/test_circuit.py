@@ -0,0 +1,103 @@
+import pytest
+import bcbackend
+from bcbackend import CircuitBreaker, CircuitOpenError
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(bcbackend.time, 'monotonic', clock)
+    # No background probing of the fake addresses.
+    monkeypatch.setattr(bcbackend, 'start_health_monitor', lambda: None)
+    return clock
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker('192.0.2.1', threshold=3, interval=5.0, max_interval=20.0, trial_timeout=10.0)
+
+def open_breaker(breaker):
+    for _ in range(breaker.threshold): breaker.record_failure(ConnectionError('refused'))
+
+def test_closed_until_threshold(breaker):
+    breaker.record_failure(ConnectionError('refused'))
+    breaker.record_failure(ConnectionError('refused'))
+    breaker.check()
+    assert breaker.state == 'closed' and breaker.online
+    breaker.record_failure(ConnectionError('refused'))
+    assert breaker.state == 'open' and not breaker.online
+    assert breaker.get_health()['last_error'] == 'refused'
+
+def test_success_resets_failures(breaker):
+    breaker.record_failure(ConnectionError())
+    breaker.record_failure(ConnectionError())
+    breaker.record_success()
+    breaker.record_failure(ConnectionError())
+    assert breaker.state == 'closed' and breaker.failures == 1
+
+def test_open_fails_fast(breaker, clock):
+    open_breaker(breaker)
+    clock.now += 4.9
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+def test_half_open_single_trial(breaker, clock):
+    open_breaker(breaker)
+    clock.now += 5.0
+    breaker.check()
+    assert breaker.state == 'half-open'
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+def test_half_open_success_closes(breaker, clock):
+    open_breaker(breaker)
+    clock.now += 5.0
+    breaker.check()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.failures == 0
+    breaker.check()
+
+def test_half_open_failure_reopens_with_backoff(breaker, clock):
+    open_breaker(breaker)
+    for interval in (10.0, 20.0, 20.0):
+        clock.now += breaker.retry_at - clock.now
+        breaker.check()
+        breaker.record_failure(ConnectionError())
+        assert breaker.state == 'open'
+        assert breaker.retry_at - clock.now == interval
+
+def test_half_open_trial_deadline(breaker, clock):
+    # A trial that never records its outcome must not keep the breaker half-open.
+    open_breaker(breaker)
+    clock.now += 5.0
+    breaker.check()
+    clock.now += 9.9
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    clock.now += 0.1
+    breaker.check()
+    assert breaker.state == 'half-open'
+
+def test_abandoned_trial_allows_another(breaker, clock):
+    open_breaker(breaker)
+    clock.now += 5.0
+    breaker.check()
+    breaker.abandon()
+    assert breaker.state == 'open'
+    breaker.check()
+    assert breaker.state == 'half-open'
+
+def test_abandon_ignored_when_closed(breaker):
+    breaker.abandon()
+    assert breaker.state == 'closed'
+
+def test_reset_closes(breaker):
+    open_breaker(breaker)
+    breaker.reset()
+    breaker.check()
+    assert breaker.state == 'closed'
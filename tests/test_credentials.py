@@ -0,0 +1,103 @@
+import pytest
+from cryptography.fernet import Fernet
+import bccredentials
+from bccredentials import CredentialStore, read_credentials_file
+
+@pytest.fixture
+def key(monkeypatch):
+    # From the environment, so neither the system keyring nor a key file is touched.
+    key = Fernet.generate_key().decode()
+    monkeypatch.setenv(bccredentials.key_env, key)
+    return key
+
+@pytest.fixture
+def store(tmp_path, key):
+    return CredentialStore(tmp_path/'credentials.enc', tmp_path/'credentials.key')
+
+def reopen(store):
+    return CredentialStore(store.path, store.key_path)
+
+def test_round_trip(store):
+    store.set('1234', ip='192.168.1.10', mac='AA-BB-CC-DD-EE-FF', serial='7001234')
+    assert b'1234' not in store.path.read_bytes()
+    stored = reopen(store)
+    assert stored.resolve({'ip': '192.168.1.10'}) == '1234'
+    assert stored.find(mac='aabbccddeeff') == {'ip': '192.168.1.10', 'mac': 'aa:bb:cc:dd:ee:ff',
+                                               'serial': '7001234', 'psk': '1234'}
+
+def test_wrong_key(store, monkeypatch):
+    store.set('1234', ip='192.168.1.10')
+    monkeypatch.setenv(bccredentials.key_env, Fernet.generate_key().decode())
+    with pytest.raises(ValueError):
+        reopen(store).resolve({'ip': '192.168.1.10'})
+
+def test_hardware_ids_before_ip(store):
+    store.set('1111', ip='192.168.1.10', mac='aa:bb:cc:dd:ee:01')
+    store.set('2222', ip='192.168.1.11', serial='7002222')
+    # The IP now belongs to another TV, so the MAC or serial wins.
+    assert store.resolve({'ip': '192.168.1.11', 'mac': 'aa:bb:cc:dd:ee:01'}) == '1111'
+    assert store.resolve({'ip': '192.168.1.10', 'serial': '7002222'}) == '2222'
+    assert store.resolve({'ip': '192.168.1.10', 'mac': 'aa:bb:cc:dd:ee:99'}) == '1111'
+
+def test_dhcp_move(store):
+    store.set('1111', ip='192.168.1.10', mac='aa:bb:cc:dd:ee:01')
+    store.set('2222', ip='192.168.1.11', mac='aa:bb:cc:dd:ee:02')
+    # The first TV is handed the second one's address.
+    assert store.set('1111', ip='192.168.1.11', mac='aa:bb:cc:dd:ee:01')
+    assert store.find(ip='192.168.1.11')['psk'] == '1111'
+    assert store.find(ip='192.168.1.10') is None
+    assert store.find(mac='aa:bb:cc:dd:ee:02') == {'ip': None, 'mac': 'aa:bb:cc:dd:ee:02', 'serial': None,
+                                                   'psk': '2222'}
+    stored = reopen(store)
+    assert stored.resolve({'ip': '192.168.1.11'}) == '1111'
+    assert stored.resolve({'mac': 'aa:bb:cc:dd:ee:02'}) == '2222'
+
+def test_set_unchanged(store):
+    assert store.set('1111', ip='192.168.1.10')
+    assert not store.set('1111', ip='192.168.1.10')
+
+def test_set_rejects_empty(store):
+    with pytest.raises(ValueError):
+        store.set('1111')
+    for psk in (None, ''):
+        with pytest.raises(ValueError):
+            store.set(psk, ip='192.168.1.10')
+
+def test_remove(store):
+    store.set('1111', ip='192.168.1.10', mac='aa:bb:cc:dd:ee:01')
+    assert store.remove(mac='aa:bb:cc:dd:ee:01')
+    assert not store.remove(ip='192.168.1.10')
+    assert reopen(store).resolve({'ip': '192.168.1.10'}) is None
+
+def test_auth_cache(store):
+    store.set_auth('192.168.1.10', '1111', True)
+    assert store.get_auth('192.168.1.10', '1111') is True
+    assert store.get_auth('192.168.1.10', '2222') is None
+    store.set('2222', ip='192.168.1.10')
+    assert store.get_auth('192.168.1.10', '1111') is None
+
+def test_import_tvs_file(store, tmp_path):
+    path = tmp_path/'tvs.txt'
+    path.write_text('192.168.1.10,1111\n192.168.8.0/22,0000\naa-bb-cc-dd-ee-02,2222\n7003333,3333\n192.168.1.12\n\n')
+    items = list(read_credentials_file(path))
+    assert items == [{'ip': '192.168.1.10', 'psk': '1111'}, {'mac': 'aa:bb:cc:dd:ee:02', 'psk': '2222'},
+                     {'serial': '7003333', 'psk': '3333'}]
+    assert store.update(items) == 3
+    assert store.resolve({'serial': '7003333'}) == '3333'
+
+def test_import_csv(store, tmp_path):
+    path = tmp_path/'tvs.csv'
+    path.write_text('IP,MAC,Serial,PSK\n'
+                    '192.168.1.10,,,1111\n'
+                    ',aa:bb:cc:dd:ee:02,7002222,2222\n'
+                    '192.168.1.12,,,\n'
+                    ',,,4444\n'
+                    'not-an-ip,,,5555\n'
+                    '192.168.1.16,,\n')
+    items = list(read_credentials_file(path))
+    assert [item['psk'] for item in items] == ['1111', '2222']
+    assert store.update(items) == 2
+    stored = reopen(store)
+    assert stored.resolve({'ip': '192.168.1.10'}) == '1111'
+    assert stored.resolve({'serial': '7002222'}) == '2222'
+    assert stored.resolve({'ip': '192.168.1.12'}) is None and stored.resolve({'ip': '192.168.1.16'}) is None
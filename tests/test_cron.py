@@ -0,0 +1,73 @@
+import json
+from datetime import datetime
+import pytest
+from bcmacros import parse_cron, cron_matches, load_macros
+
+# 2024-06-03 is a Monday.
+monday = datetime(2024, 6, 3, 9, 0)
+sunday = datetime(2024, 6, 2, 9, 0)
+
+def test_parse_cron_fields():
+    cron = parse_cron('*/15 9-17 1,15 * 1-5')
+    assert cron['minute'] == {0, 15, 30, 45}
+    assert cron['hour'] == set(range(9, 18))
+    assert cron['day'] == {1, 15}
+    assert cron['month'] == set(range(1, 13))
+    assert cron['weekday'] == {1, 2, 3, 4, 5}
+
+def test_parse_cron_step_from_value():
+    assert parse_cron('50/5 * * * *')['minute'] == {50, 55}
+
+def test_parse_cron_sunday_as_seven():
+    assert parse_cron('0 0 * * 7')['weekday'] == {0}
+    assert parse_cron('0 0 * * 5-7')['weekday'] == {5, 6, 0}
+
+@pytest.mark.parametrize('expression', ['* * * *', '60 * * * *', '* 24 * * *', '* * 0 * *', '* * * 13 *',
+                                        '* * * * 8', '5-1 * * * *', 'a * * * *'])
+def test_parse_cron_invalid(expression):
+    with pytest.raises(ValueError):
+        parse_cron(expression)
+
+def test_cron_matches_time():
+    cron = parse_cron('0 9 * * *')
+    assert cron_matches(cron, monday)
+    assert not cron_matches(cron, monday.replace(minute=1))
+    assert not cron_matches(cron, monday.replace(hour=10))
+
+def test_cron_matches_weekday():
+    cron = parse_cron('0 9 * * 1-5')
+    assert cron_matches(cron, monday)
+    assert not cron_matches(cron, sunday)
+
+def test_cron_matches_sunday():
+    assert cron_matches(parse_cron('0 9 * * 0'), sunday)
+    assert cron_matches(parse_cron('0 9 * * 7'), sunday)
+
+def test_cron_matches_day_and_weekday_either():
+    # Both restricted: the 15th or any Monday.
+    cron = parse_cron('0 9 15 * 1')
+    assert cron_matches(cron, monday)
+    assert cron_matches(cron, datetime(2024, 6, 15, 9, 0))
+    assert not cron_matches(cron, datetime(2024, 6, 14, 9, 0))
+
+def test_cron_matches_day_with_any_weekday():
+    cron = parse_cron('0 9 15 * *')
+    assert cron_matches(cron, datetime(2024, 6, 15, 9, 0))
+    assert not cron_matches(cron, monday)
+
+def test_cron_matches_month():
+    cron = parse_cron('0 9 3 7 *')
+    assert not cron_matches(cron, monday)
+    assert cron_matches(cron, datetime(2024, 7, 3, 9, 0))
+
+def test_load_macros_groups_only(tmp_path):
+    path = tmp_path/'macros.json'
+    path.write_text(json.dumps({'groups': {'lobby': ['192.168.1.10']}}))
+    config = load_macros(path)
+    assert config['macros'] == {} and config['schedule'] == []
+
+def test_load_macros_unknown_scheduled_macro(tmp_path):
+    path = tmp_path/'macros.json'
+    path.write_text(json.dumps({'schedule': [{'cron': '0 9 * * *', 'macro': 'open'}]}))
+    with pytest.raises(ValueError):
+        load_macros(path)
@@ -0,0 +1,11 @@
+from ipaddress import ip_address
+import pytest
+from bcmacros import run_macro_on_tv
+
+steps = [{'action': 'power', 'value': 'on'}, {'action': 'input', 'value': 'Game'}, {'action': 'volume', 'value': 15}]
+
+@pytest.mark.parametrize('ip', ['192.168.1.20', 'fe80::1', '2001:db8::20'])
+def test_dry_run(ip):
+    run = run_macro_on_tv({'ip': ip_address(ip), 'psk': '0000', 'modelName': 'KD-55X85J'}, steps, dry_run=True)
+    assert run['ok']
+    assert run['steps'][0]['detail'] == 'Active' and run['steps'][2]['detail'] == 15